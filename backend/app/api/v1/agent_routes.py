@@ -11,6 +11,8 @@ from typing import Dict, Any, List, Optional
 import logging
 import json
 import asyncio
+import re
+import time
 from pydantic import BaseModel, Field
 
 from app.services.agent_service import agent_service, AgentConfig
@@ -20,6 +22,13 @@ from app.core.security import verify_token
 
 logger = logging.getLogger(__name__)
 
+# 回答中的视频信息块
+_VIDEO_INFO_RE = re.compile(r'<video_info>(.*?)</video_info>', re.DOTALL)
+# 中文字符，用于粗略估算token数
+_CHINESE_CHAR_RE = re.compile(r'[\u4e00-\u9fff]')
+# 回答中的引用标记：[1]、(来源:xxx)、引用自、参考
+_CITATION_RE = re.compile(r'\[\d+\]|\(来源:.*?\)|引用自|参考')
+
 # 创建路由器
 router = APIRouter(
     prefix="/agent",
@@ -80,8 +89,6 @@ async def chat_with_agent(request: AgentRequest) -> AgentResponse:
     Agent会根据需要自动调用MCP注册的工具来完成任务。
     Planning-then-Execution模式会让Agent思考、推理、决定是否调用工具，并最终生成回答。
     """
-    import time
-    import re
     start_time = time.time()
 
     try:
@@ -91,7 +98,9 @@ async def chat_with_agent(request: AgentRequest) -> AgentResponse:
         all_events = []
 
         async def collect_callback(event_data):
-            """收集所有流式事件"""
+            """收集所有流式事件（token事件只是最终答案的片段，完整答案已在响应中，不收集）"""
+            if event_data.get('type') == 'token':
+                return
             all_events.append(event_data)
             logger.info(f"[Planning-改造] 收集事件: {event_data.get('type')}")
 
@@ -139,14 +148,14 @@ async def chat_with_agent(request: AgentRequest) -> AgentResponse:
         video_info_list = []
         text_content = result
 
-        video_info_match = re.search(r'<video_info>(.*?)</video_info>', result, re.DOTALL)
+        video_info_match = _VIDEO_INFO_RE.search(result)
         if video_info_match:
             try:
                 raw_content = video_info_match.group(1)
                 video_info_list = json.loads(raw_content)
                 if not isinstance(video_info_list, list):
                     video_info_list = [video_info_list]
-                text_content = re.sub(r'<video_info>.*?</video_info>', '', result, flags=re.DOTALL).strip()
+                text_content = _VIDEO_INFO_RE.sub('', result).strip()
             except Exception as e:
                 logger.error(f"[Planning-改造] 解析视频信息失败: {str(e)}")
 
@@ -355,8 +364,6 @@ async def chat_with_agent_stream(request: AgentRequest):
 
     async def event_generator():
         """生成SSE事件流 - 真正的流式"""
-        import time
-        import re
 
         start_time = time.time()
 
@@ -374,8 +381,9 @@ async def chat_with_agent_stream(request: AgentRequest):
         # 流式回调函数
         async def stream_callback(event_data: Dict[str, Any]):
             """将事件推送到队列"""
-            current_time = time.time() - start_time
-            logger.info(f"[SSE-Stream] [{current_time:.3f}s] 推送事件到队列: {event_data.get('type')}")
+            if event_data.get('type') != 'token':
+                current_time = time.time() - start_time
+                logger.info(f"[SSE-Stream] [{current_time:.3f}s] 推送事件到队列: {event_data.get('type')}")
             await event_queue.put(event_data)
 
         # 创建agent处理任务
@@ -428,14 +436,14 @@ async def chat_with_agent_stream(request: AgentRequest):
                 video_info_list = []
                 text_content = result
 
-                video_info_match = re.search(r'<video_info>(.*?)</video_info>', result, re.DOTALL)
+                video_info_match = _VIDEO_INFO_RE.search(result)
                 if video_info_match:
                     try:
                         raw_content = video_info_match.group(1)
                         video_info_list = json.loads(raw_content)
                         if not isinstance(video_info_list, list):
                             video_info_list = [video_info_list]
-                        text_content = re.sub(r'<video_info>.*?</video_info>', '', result, flags=re.DOTALL).strip()
+                        text_content = _VIDEO_INFO_RE.sub('', result).strip()
                     except Exception as e:
                         logger.error(f"[SSE-Stream] 解析视频信息失败: {str(e)}")
 
@@ -464,25 +472,42 @@ async def chat_with_agent_stream(request: AgentRequest):
         task = asyncio.create_task(process_agent())
 
         try:
+            # 合并token事件时多取出的下一个事件
+            held_events = []
             # 持续从队列中获取事件并发送
             while True:
-                # 使用超时等待，避免无限阻塞
-                try:
-                    event_data = await asyncio.wait_for(event_queue.get(), timeout=0.1)
-                except asyncio.TimeoutError:
-                    # 发送心跳保持连接（使用字节）
-                    yield b": heartbeat\n\n"
-                    continue
+                if held_events:
+                    event_data = held_events.pop()
+                else:
+                    # 使用超时等待，避免无限阻塞
+                    try:
+                        event_data = await asyncio.wait_for(event_queue.get(), timeout=0.1)
+                    except asyncio.TimeoutError:
+                        # 发送心跳保持连接（使用字节）
+                        yield b": heartbeat\n\n"
+                        continue
 
                 # None 表示结束
                 if event_data is None:
                     logger.info("[SSE-Stream] 收到结束标记")
                     break
 
+                # 队列中积压的连续token事件合并为一个发送，避免每个片段都附带填充数据
+                if event_data.get('type') == 'token':
+                    deltas = [event_data['delta']]
+                    while not event_queue.empty():
+                        queued = event_queue.get_nowait()
+                        if queued is None or queued.get('type') != 'token':
+                            held_events.append(queued)
+                            break
+                        deltas.append(queued['delta'])
+                    event_data = {"type": "token", "delta": "".join(deltas)}
+
                 # 格式化为SSE格式（使用字节）
                 sse_data = f"data: {json.dumps(event_data, ensure_ascii=False)}\n\n"
-                current_time = time.time() - start_time
-                logger.info(f"[SSE-Stream] [{current_time:.3f}s] 实际 yield 事件: {event_data.get('type')}")
+                if event_data.get('type') != 'token':
+                    current_time = time.time() - start_time
+                    logger.info(f"[SSE-Stream] [{current_time:.3f}s] 实际 yield 事件: {event_data.get('type')}")
 
                 # 添加大量填充数据（8KB）以强制HTTP缓冲区和浏览器立即刷新
                 # 使用注释形式的填充，不影响SSE解析
@@ -529,8 +554,6 @@ async def evaluate_question(request: AgentRequest) -> AgentResponse:
     不需要token验证，接收问题并返回标准化答案，用于评测系统调用。
     包含详细的元数据用于性能分析。
     """
-    import time
-    import re
     start_time = time.time()
 
     try:
@@ -566,7 +589,7 @@ async def evaluate_question(request: AgentRequest) -> AgentResponse:
         # 简单的token估算（中文约2字符=1token，英文约4字符=1token）
         # 这是粗略估算，实际应该使用tokenizer
         def estimate_tokens(text: str) -> int:
-            chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', text))
+            chinese_chars = len(_CHINESE_CHAR_RE.findall(text))
             other_chars = len(text) - chinese_chars
             return int(chinese_chars / 2 + other_chars / 4)
 
@@ -576,16 +599,7 @@ async def evaluate_question(request: AgentRequest) -> AgentResponse:
 
         # 检查是否包含引用
         def has_citations(text: str) -> bool:
-            citation_patterns = [
-                r'\[\d+\]',  # [1], [2]
-                r'\(来源:.*?\)',  # (来源:xxx)
-                r'引用自',
-                r'参考'
-            ]
-            for pattern in citation_patterns:
-                if re.search(pattern, text):
-                    return True
-            return False
+            return _CITATION_RE.search(text) is not None
 
         logger.info(f"[Evaluate] 评估完成，耗时: {processing_time:.2f}s, tokens: {total_tokens}")
 
@@ -709,7 +723,8 @@ search_video_by_vector(query="用户的搜索词", top_k=10, user_id="{user_id}"
             """实时发送事件到WebSocket客户端"""
             try:
                 await websocket.send_json(event_data)
-                logger.info(f"[WebSocket] 已发送事件: {event_data.get('type')}")
+                if event_data.get('type') != 'token':
+                    logger.info(f"[WebSocket] 已发送事件: {event_data.get('type')}")
             except Exception as e:
                 logger.error(f"[WebSocket] 发送事件失败: {str(e)}")
 
@@ -735,18 +750,17 @@ search_video_by_vector(query="用户的搜索词", top_k=10, user_id="{user_id}"
             result = response
 
         # 解析视频信息
-        import re
         video_info_list = []
         text_content = result
 
-        video_info_match = re.search(r'<video_info>(.*?)</video_info>', result, re.DOTALL)
+        video_info_match = _VIDEO_INFO_RE.search(result)
         if video_info_match:
             try:
                 raw_content = video_info_match.group(1)
                 video_info_list = json.loads(raw_content)
                 if not isinstance(video_info_list, list):
                     video_info_list = [video_info_list]
-                text_content = re.sub(r'<video_info>.*?</video_info>', '', result, flags=re.DOTALL).strip()
+                text_content = _VIDEO_INFO_RE.sub('', result).strip()
             except Exception as e:
                 logger.error(f"[WebSocket] 解析视频信息失败: {str(e)}")
 
@@ -773,7 +787,7 @@ search_video_by_vector(query="用户的搜索词", top_k=10, user_id="{user_id}"
         text_content = '\n'.join(filtered_lines).strip()
 
         # 再次移除可能残留的<video_info>标签
-        text_content = re.sub(r'<video_info>.*?</video_info>', '', text_content, flags=re.DOTALL).strip()
+        text_content = _VIDEO_INFO_RE.sub('', text_content).strip()
 
         # 如果移除后内容为空，使用默认消息
         if not text_content and video_info_list:
@@ -19,6 +19,8 @@ class Settings(BaseSettings):
     host: str = "0.0.0.0"
     port: int = 8000
     log_level: str = "INFO"
+    # 日志写入放到后台线程（QueueHandler + QueueListener），请求处理中只做入队
+    log_async_enabled: bool = True
     cors_origins: List[str] = ["*"]
     
     # 安全配置
@@ -32,6 +34,9 @@ class Settings(BaseSettings):
     volcengine_model: str = "doubao-seed-1-6-thinking-250715"
     volcengine_embedding_model: str = "text-embedding-v1"
     volcengine_embedding_dim: int = 2560
+    # HTTP API模式下大模型/embedding请求共享的连接池大小
+    llm_http_pool_connections: int = 4
+    llm_http_pool_maxsize: int = 32
     
     # Milvus配置
     milvus_host: str = "localhost"
@@ -72,6 +77,38 @@ class Settings(BaseSettings):
     whisper_language: str = "zh"
     whisper_device: str = "cpu"
     
+    # Agent计划缓存配置
+    agent_plan_cache_enabled: bool = True
+    # 是否启用基于向量相似度的语义匹配：精确未命中时需要一次embedding请求，且只复用计划结构，默认关闭
+    agent_plan_cache_semantic: bool = False
+    agent_plan_cache_similarity: float = 0.92
+    agent_plan_cache_ttl: int = 3600  # 秒
+    
+    # Agent大模型响应缓存：相同(系统提示, 用户提示, 温度)的调用直接复用结果，并发的相同调用只请求一次
+    agent_llm_cache_enabled: bool = True
+    agent_llm_cache_ttl: int = 600  # 秒
+    agent_llm_cache_max_entries: int = 2048
+    
+    # Agent快速路径：请求不含工具相关关键词时跳过规划阶段直接回答
+    agent_fast_path_enabled: bool = True
+    # 流式生成计划，第一个步骤出现后立即开始生成其执行行动
+    agent_plan_streaming_enabled: bool = True
+    # 执行步骤提示中保留原文的最近执行历史条数，更早的条目只保留前若干字符（不大于0时保留全部原文）
+    agent_step_history_window: int = 6
+    agent_step_history_preview_chars: int = 200
+    
+    # MCP同步工具执行线程池大小
+    mcp_tool_max_workers: int = 8
+    # Agent单次工具调用超时时间（秒）
+    agent_tool_call_timeout: float = 30.0
+    # 单次Agent调用内并发执行的工具调用数上限
+    agent_tool_max_concurrency: int = 4
+    # 按配置共享的Agent实例数上限（LRU淘汰）
+    agent_max_shared_agents: int = 64
+    # AgentService.process_requests 单批请求数和并发处理数上限
+    agent_batch_max_requests: int = 100
+    agent_batch_max_concurrency: int = 8
+    
     # Celery配置
     celery_broker_url: str = "redis://localhost:6379/0"
     celery_result_backend: str = "redis://localhost:6379/0"
@@ -10,7 +10,10 @@ import json
 import logging
 from pydantic import BaseModel, Field
 import asyncio
-from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps, cached_property, partial
+
+from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +35,15 @@ class ToolDefinition(BaseModel):
     returns: Dict[str, Any] = Field(default_factory=dict, description="返回值定义")
     tags: List[str] = Field(default_factory=list, description="工具标签")
 
+    @cached_property
+    def rendered_line(self) -> str:
+        """供Agent提示词使用的工具说明（名称、描述和调用格式示例），首次访问时渲染并缓存"""
+        params_info = ", ".join(param.name for param in self.parameters)
+        return (
+            f"- {self.name}: {self.description}\n"
+            f"  调用格式示例: {self.name}({params_info})"
+        )
+
 
 class ToolResponse(BaseModel):
     """工具响应"""
@@ -62,7 +74,34 @@ class MCPServer:
         self._resources: Dict[str, Any] = {}
         # 提示词模板库
         self._prompt_templates: Dict[str, str] = {}
+        # 工具注册表版本号，每次注册工具时递增，用于失效依赖工具列表的缓存
+        self._tools_version = 0
+        # 同步工具函数的专用线程池，限制并发并复用工作线程
+        self._tool_executor = ThreadPoolExecutor(
+            max_workers=settings.mcp_tool_max_workers,
+            thread_name_prefix="mcp-tool"
+        )
         logger.info("MCP Server initialized")
+
+    @property
+    def tools_version(self) -> int:
+        """
+        获取工具注册表版本号
+
+        Returns:
+            当前版本号，工具注册表发生变化时递增
+        """
+        return self._tools_version
+
+    @property
+    def tool_count(self) -> int:
+        """
+        获取已注册工具数量
+
+        Returns:
+            工具数量
+        """
+        return len(self._tools)
     
     def register_tool(
         self, 
@@ -104,6 +143,7 @@ class MCPServer:
                 tags=tags or []
             )
         }
+        self._tools_version += 1
         logger.info(f"Tool registered: {name}")
     
     def get_available_tools(self) -> List[ToolDefinition]:
@@ -190,8 +230,12 @@ class MCPServer:
                 # 异步调用
                 result = await tool['function'](**parameters)
             else:
-                # 同步函数转换为异步调用
-                result = await asyncio.to_thread(tool['function'], **parameters)
+                # 同步函数在专用线程池中执行
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(
+                    self._tool_executor,
+                    partial(tool['function'], **parameters)
+                )
             
             return ToolResponse(
                 success=True,
@@ -286,6 +330,15 @@ class MCPServer:
                 logger.error(f"Error rendering prompt template {name}: {str(e)}")
         return None
 
+    def shutdown(self) -> None:
+        """
+        关闭同步工具线程池
+
+        不等待正在执行的工具调用，尚未开始的调用直接取消
+        """
+        self._tool_executor.shutdown(wait=False, cancel_futures=True)
+        logger.info("MCP tool executor shut down")
+
 
 # 创建全局MCP服务器实例
 mcp_server = MCPServer()
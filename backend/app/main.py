@@ -2,8 +2,23 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
+import asyncio
 import logging
 import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+# 尝试使用uvloop作为事件循环实现，必须在导入业务模块（Agent后台事件循环在导入时创建）之前安装
+HAS_UVLOOP = False
+if sys.platform != "win32":
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        HAS_UVLOOP = True
+    except ImportError:
+        pass
+
 from app.api import api_router
 from app.core.config import settings
 from app.core.database import engine, Base
@@ -14,7 +29,21 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
+# 异步日志：根日志器只保留一个入队的QueueHandler，终端/文件I/O和各输出处理器的格式化（时间戳、布局）
+# 由后台线程完成，避免请求处理时在全局日志锁和I/O上串行等待。
+# 注意QueueHandler.prepare()仍在调用线程中合并消息参数（msg % args）并渲染异常堆栈：
+# 这样入队的是当时的消息快照，不会因为参数对象之后被修改而记录错误的内容
+log_listener = None
+if settings.log_async_enabled:
+    root_logger = logging.getLogger()
+    log_queue = queue.SimpleQueue()
+    log_listener = QueueListener(log_queue, *root_logger.handlers, respect_handler_level=True)
+    root_logger.handlers = [QueueHandler(log_queue)]
+    log_listener.start()
+
 logger = logging.getLogger(__name__)
+if not HAS_UVLOOP:
+    logger.info("uvloop未安装，使用标准asyncio事件循环")
 
 # 创建FastAPI应用实例
 app = FastAPI(
@@ -96,6 +125,24 @@ async def shutdown_event():
         except Exception as e:
             logger.error(f"Error disposing database connection: {str(e)}")
 
+    # 释放缓存的Agent实例
+    try:
+        from app.services.agent_service import agent_service
+        agent_service.clear_agents()
+    except Exception as e:
+        logger.error(f"Error clearing agents: {str(e)}")
+
+    # 关闭MCP同步工具线程池
+    try:
+        from app.core.mcp import mcp_server
+        mcp_server.shutdown()
+    except Exception as e:
+        logger.error(f"Error shutting down MCP tool executor: {str(e)}")
+
+    # 停止后台日志线程，写出队列中剩余的日志
+    if log_listener is not None:
+        log_listener.stop()
+
 
 @app.get("/")
 async def root():
@@ -53,6 +53,8 @@ class User(UserBase):
 
 class Token(BaseModel):
     """令牌模型"""
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     access_token: str
     token_type: str = "bearer"
     expires_in: Optional[int] = None
@@ -60,11 +62,15 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     """令牌数据模型"""
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     username: Optional[str] = None
 
 
 class LoginRequest(BaseModel):
     """登录请求模型"""
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     username: str = Field(..., description="用户名")
     password: str = Field(..., description="密码")
 
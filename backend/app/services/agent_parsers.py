@@ -0,0 +1,481 @@
+"""
+Agent输出解析工具
+
+解析Planning-then-Execution模式下大模型输出的计划、执行步骤和最终答案。
+这些函数在每个步骤都会调用，全部为带类型标注的纯函数，不依赖Agent状态，
+可以直接用 mypyc 或 Cython（纯Python模式，无需改写为 .pyx）编译为C扩展以减少解释器开销：
+
+    mypyc app/services/agent_parsers.py
+    cythonize -i -3 app/services/agent_parsers.py
+
+编译产物与源文件位于同一目录时会被优先导入，未编译时按普通Python模块运行。
+"""
+
+import ast
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 计划步骤末尾的依赖标注，例如 "(依赖: 1, 2)" 或 "（依赖：无）"
+_PLAN_DEPENDENCY_RE = re.compile(r'[(（]\s*依赖\s*[:：]\s*([^)）]*)[)）]')
+_DIGITS_RE = re.compile(r'\d+')
+# 计划步骤行的编号前缀 "1." ~ "99."
+PLAN_STEP_PREFIXES = tuple(f"{i}." for i in range(1, 100))
+# 计划步骤行：行首（不缩进）编号 1~99 加 "."，捕获编号和编号之后的内容；缩进的编号行是步骤下的子项，不算步骤
+_PLAN_LINE_RE = re.compile(r'^([1-9][0-9]?)\.(.*)$', re.MULTILINE)
+
+# 工具调用 tool_name(...)：工具名之后的参数部分贪婪匹配到最后一个右括号，引号内的括号不会截断参数
+_TOOL_CALL_RE = re.compile(r'^\s*([^\s(]+)\s*\((.*)\)', re.DOTALL)
+
+# 工具调用参数 key=value，value 可以是单/双引号字符串（支持转义）或不含逗号的裸值
+_PARAM_RE = re.compile(r'(\w+)\s*=\s*("(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|[^,]+)')
+
+# 最终答案中需要过滤的内部过程标记
+# 以这些标记开头的段落一直持续到下一个空行
+_BLOCK_MARKERS = ("Plan:", "Reasoning:")
+# 以这些标记开头的行整行移除
+_LINE_MARKERS = ("Step:", "Action:", "Result:", "Execution Complete:")
+_FINAL_ANSWER_MARKER = "Final Answer:"
+_EXECUTION_COMPLETE_MARKER = "Execution Complete:"
+# 最终答案中的视频信息块标签，视频信息随完成事件单独返回，不作为答案文字展示
+_VIDEO_INFO_OPEN = "<video_info>"
+_VIDEO_INFO_CLOSE = "</video_info>"
+
+
+def _scan_process_markers(text: str, collapse_blank_lines: bool) -> str:
+    """
+    单次逐行扫描移除内部过程标记
+
+    Args:
+        text: 大模型输出文本
+        collapse_blank_lines: 是否将连续空行合并为一个
+
+    Returns:
+        str: 过滤后的文本（未去除首尾空白）
+    """
+    kept: List[str] = []
+    in_block = False
+    previous_blank = False
+    for line in text.split("\n"):
+        stripped = line.lstrip()
+        if in_block:
+            # Plan: / Reasoning: 段落到空行为止
+            if not stripped:
+                in_block = False
+            continue
+        if stripped.startswith(_BLOCK_MARKERS):
+            in_block = True
+            continue
+        if stripped.startswith(_LINE_MARKERS):
+            continue
+        if stripped.startswith(_FINAL_ANSWER_MARKER):
+            # 保留 Final Answer: 标记之后的内容
+            line = stripped[len(_FINAL_ANSWER_MARKER):].lstrip()
+        else:
+            # 移除行内残留的 Execution Complete: 标记及其后内容
+            marker_pos = line.find(_EXECUTION_COMPLETE_MARKER)
+            if marker_pos != -1:
+                line = line[:marker_pos]
+        is_blank = not line.strip()
+        if collapse_blank_lines and is_blank and previous_blank:
+            continue
+        previous_blank = is_blank
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def strip_process_markers(text: str) -> str:
+    """
+    移除文本中的内部过程标记（Plan/Reasoning段落、Step/Action/Result行等）
+
+    Args:
+        text: 大模型输出文本
+
+    Returns:
+        str: 过滤后的文本（未去除首尾空白）
+    """
+    return _scan_process_markers(text, collapse_blank_lines=False)
+
+
+def extract_final_answer(response: str) -> str:
+    """
+    提取最终答案并过滤内部标记
+
+    Args:
+        response: 总结阶段的大模型输出
+
+    Returns:
+        str: 最终答案，过滤后为空时返回 "处理完成"
+    """
+    try:
+        final_answer = response
+
+        # 步骤1: 尝试提取 Final Answer: 后面的内容（每个标记只查找一次）
+        answer_pos = response.find(_FINAL_ANSWER_MARKER)
+        if answer_pos != -1:
+            final_answer = response[answer_pos + len(_FINAL_ANSWER_MARKER):].strip()
+        else:
+            complete_pos = response.find(_EXECUTION_COMPLETE_MARKER)
+            if complete_pos != -1:
+                # 从执行完成后查找可能的答案（此时不含 Final Answer:，无需再次提取）
+                final_answer = response[complete_pos + len(_EXECUTION_COMPLETE_MARKER):].strip()
+            else:
+                finish_pos = response.find("Finish[")
+                if finish_pos != -1:
+                    # 兼容旧格式
+                    finish_start = finish_pos + 7
+                    finish_end = response.rfind("]")
+                    if finish_start < finish_end:
+                        final_answer = response[finish_start:finish_end].strip()
+
+        # 步骤2: 过滤掉所有内部过程标记，并清理多余的空白
+        final_answer = strip_process_markers(final_answer).strip()
+
+        # 步骤3: 如果过滤后内容为空，返回一个友好的默认消息
+        if not final_answer:
+            logger.warning("[Planning-then-Execution模式] 过滤后内容为空")
+            return "处理完成"
+
+        return final_answer
+
+    except Exception as e:
+        logger.error(f"[Planning-then-Execution模式] 提取最终答案失败: {str(e)}")
+        # 发生错误时，尝试至少返回一些内容
+        return response.split("Final Answer:")[-1].strip() if "Final Answer:" in response else response
+
+
+def clean_final_answer(response: str) -> str:
+    """
+    清理最终答案，移除所有内部过程标记并压缩多余空行
+
+    Args:
+        response: 大模型输出
+
+    Returns:
+        str: 清理后的答案
+    """
+    return _scan_process_markers(response, collapse_blank_lines=True).strip()
+
+
+def _partial_marker_length(text: str, marker: str) -> int:
+    """text 末尾可能是 marker 开头部分的长度（marker 被拆分在两个增量片段中时需要等下一个片段）"""
+    start = text.rfind(marker[0], max(0, len(text) - len(marker) + 1))
+    if start != -1 and marker.startswith(text[start:]):
+        return len(text) - start
+    return 0
+
+
+class FinalAnswerStream:
+    """
+    从流式生成的总结中增量提取最终答案文字
+
+    只输出 "Final Answer:" 之后的内容，并去掉<video_info>块。标记可能被拆分在相邻的增量片段中，
+    末尾可能属于标记的部分留到下一个片段再判断。输出只用于实时展示，完整答案仍以 extract_final_answer 为准。
+    """
+
+    def __init__(self) -> None:
+        self._pending = ""
+        self._started = False
+        self._in_video_info = False
+        self._emitted = False
+
+    def feed(self, delta: str) -> str:
+        """
+        追加一个增量片段
+
+        Args:
+            delta: 大模型输出的增量文本
+
+        Returns:
+            str: 可以展示给用户的新增答案文字，可能为空
+        """
+        pending = self._pending + delta
+        parts: List[str] = []
+        while pending:
+            if not self._started:
+                pos = pending.find(_FINAL_ANSWER_MARKER)
+                if pos == -1:
+                    keep = _partial_marker_length(pending, _FINAL_ANSWER_MARKER)
+                    pending = pending[len(pending) - keep:]
+                    break
+                pending = pending[pos + len(_FINAL_ANSWER_MARKER):]
+                self._started = True
+            elif self._in_video_info:
+                pos = pending.find(_VIDEO_INFO_CLOSE)
+                if pos == -1:
+                    keep = _partial_marker_length(pending, _VIDEO_INFO_CLOSE)
+                    pending = pending[len(pending) - keep:]
+                    break
+                pending = pending[pos + len(_VIDEO_INFO_CLOSE):]
+                self._in_video_info = False
+            else:
+                pos = pending.find(_VIDEO_INFO_OPEN)
+                if pos == -1:
+                    keep = _partial_marker_length(pending, _VIDEO_INFO_OPEN)
+                    parts.append(pending[:len(pending) - keep])
+                    pending = pending[len(pending) - keep:]
+                    break
+                parts.append(pending[:pos])
+                pending = pending[pos + len(_VIDEO_INFO_OPEN):]
+                self._in_video_info = True
+        self._pending = pending
+
+        text = "".join(parts)
+        if not self._emitted:
+            # 与 extract_final_answer 一致，去掉答案开头的空白
+            text = text.lstrip()
+            self._emitted = bool(text)
+        return text
+
+
+def parse_plan_with_reasoning(response: str) -> Tuple[List[str], str, Optional[List[Optional[List[int]]]]]:
+    """
+    解析LLM生成的计划，提取步骤列表、推理过程和步骤依赖关系
+
+    Args:
+        response: 规划阶段的大模型输出
+
+    Returns:
+        tuple: (步骤列表, 推理过程, 依赖关系)。依赖关系与步骤列表一一对应，
+            元素为依赖的步骤编号列表，未标注的步骤为None；计划中完全没有
+            依赖标注时整体为None。依赖的步骤编号是步骤在列表中的位置（从1开始），
+            计划编号不连续时按编号顺序换算
+    """
+    try:
+        plan_steps: List[str] = []
+        plan_dependencies: List[Optional[List[int]]] = []
+        reasoning = "无详细推理"
+
+        # 每个标记只查找一次，后续切片都基于这些偏移量
+        reason_pos = response.find("Reasoning:")
+        plan_pos = response.find("Plan:")
+
+        # 提取推理过程
+        if reason_pos != -1:
+            reason_start = reason_pos + len("Reasoning:")
+            # 找到下一个可能的部分开始位置
+            next_section_start = len(response)
+            for marker in ("Plan:", "Step:", "Execution:"):
+                if marker == "Plan:" and plan_pos >= reason_start:
+                    pos = plan_pos
+                else:
+                    pos = response.find(marker, reason_start, next_section_start)
+                if pos != -1 and pos < next_section_start:
+                    next_section_start = pos
+            reasoning = response[reason_start:next_section_start].strip()
+
+        # 提取计划步骤：从 Plan: 之后一次正则扫描找出所有编号行（推理部分在计划之后时扫描到推理部分为止）
+        if plan_pos != -1:
+            plan_end = reason_pos if reason_pos > plan_pos else len(response)
+            numbered_steps: List[Tuple[int, str, Optional[List[int]]]] = []
+            for step_match in _PLAN_LINE_RE.finditer(response, plan_pos, plan_end):
+                step_parts = step_match.group(2)
+                # 提取并移除步骤末尾的依赖标注
+                deps: Optional[List[int]] = None
+                dep_match = _PLAN_DEPENDENCY_RE.search(step_parts)
+                if dep_match:
+                    deps = [int(n) for n in _DIGITS_RE.findall(dep_match.group(1))]
+                    step_parts = step_parts[:dep_match.start()]
+                step_parts = step_parts.strip()
+                # 如果包含"-"，移除后面的预期工具部分
+                if "-" in step_parts and not step_parts.startswith("-"):
+                    step_desc = step_parts.partition("-")[0].strip()
+                else:
+                    step_desc = step_parts
+                if step_desc:
+                    numbered_steps.append((int(step_match.group(1)), step_desc, deps))
+            # 按步骤编号排序（稳定排序，编号相同时保持原顺序），步骤按排序后的位置重新编号
+            numbered_steps.sort(key=lambda item: item[0])
+            # 依赖标注写的是计划中的编号，换算为位置；编号重复时对应第一个，引用不存在的编号的依赖忽略
+            positions: Dict[int, int] = {}
+            for position, (number, _, _) in enumerate(numbered_steps, 1):
+                positions.setdefault(number, position)
+            for _, step_desc, deps in numbered_steps:
+                plan_steps.append(step_desc)
+                plan_dependencies.append(
+                    None if deps is None else [positions[n] for n in deps if n in positions]
+                )
+
+        if all(deps is None for deps in plan_dependencies):
+            return plan_steps, reasoning, None
+        return plan_steps, reasoning, plan_dependencies
+    except Exception as e:
+        logger.error(f"[Planning-then-Execution模式] 解析计划失败: {str(e)}")
+        return [], "解析计划时出错", None
+
+
+def group_steps_into_waves(step_count: int, plan_dependencies: Optional[List[Optional[List[int]]]]) -> List[List[int]]:
+    """
+    按步骤依赖关系的拓扑层级分组
+
+    Args:
+        step_count: 步骤总数
+        plan_dependencies: 每个步骤依赖的前序步骤编号列表，None表示计划未声明依赖
+
+    Returns:
+        list: 步骤编号批次列表，同一批次内的步骤互不依赖
+    """
+    if not plan_dependencies:
+        # 计划未声明依赖关系时保持严格顺序执行
+        return [[step_num] for step_num in range(1, step_count + 1)]
+
+    levels: Dict[int, int] = {}
+    waves: List[List[int]] = []
+    for step_num in range(1, step_count + 1):
+        deps = plan_dependencies[step_num - 1] if step_num <= len(plan_dependencies) else None
+        if deps is None:
+            # 未标注依赖的步骤保守地依赖上一步
+            deps = [step_num - 1]
+        level = 1 + max((levels[d] for d in deps if 1 <= d < step_num), default=-1)
+        levels[step_num] = level
+        if level == len(waves):
+            waves.append([])
+        waves[level].append(step_num)
+    return waves
+
+
+def parse_execution_step(response: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    解析执行阶段的步骤响应
+
+    Args:
+        response: 执行阶段的大模型输出
+
+    Returns:
+        tuple: (步骤说明, 行动)，未找到对应部分时为None
+    """
+    try:
+        step_info: Optional[str] = None
+        action: Optional[str] = None
+
+        # 每个标记只查找一次
+        step_pos = response.find("Step:")
+        action_pos = response.find("Action:")
+
+        # 提取Step部分
+        if step_pos != -1:
+            step_start = step_pos + 5
+            # 找到Step之后Action部分的开始位置
+            if action_pos >= step_start:
+                action_start_pos = action_pos
+            else:
+                action_start_pos = response.find("Action:", step_start)
+            if action_start_pos != -1:
+                step_info = response[step_start:action_start_pos].strip()
+            else:
+                step_info = response[step_start:].strip()
+
+        # 提取Action部分
+        if action_pos != -1:
+            action_start = action_pos + 7
+            # 找到Result部分的开始位置或文本结束
+            result_start_pos = response.find("Result:", action_start)
+            if result_start_pos != -1:
+                action = response[action_start:result_start_pos].strip()
+            else:
+                action = response[action_start:].strip()
+
+        return step_info, action
+    except Exception as e:
+        logger.error(f"[Planning-then-Execution模式] 解析步骤响应失败: {str(e)}")
+        return None, None
+
+
+def parse_execution_actions(response: str) -> Tuple[Optional[str], List[str]]:
+    """
+    解析执行阶段的步骤响应，支持同一步骤中的多行 "Action:"
+
+    同一步骤内互不依赖的多个工具调用可以各写一行 "Action:"，由调用方并发执行。
+    直接回答 Direct[...] 的内容可能跨多行，始终作为唯一的行动返回。
+
+    Args:
+        response: 执行阶段的大模型输出
+
+    Returns:
+        tuple: (步骤说明, 行动列表)，未找到行动时为空列表
+    """
+    step_info, action = parse_execution_step(response)
+    if not action:
+        return step_info, []
+    if action.startswith("Direct["):
+        return step_info, [action]
+    actions = [part.strip() for part in action.split("Action:")]
+    return step_info, [part for part in actions if part]
+
+
+def split_tool_call(action: str) -> Optional[Tuple[str, str]]:
+    """
+    拆分工具调用行为工具名和括号内的参数字符串，例如 search(query="a, b") -> ("search", 'query="a, b"')
+
+    Args:
+        action: 工具调用行动文本
+
+    Returns:
+        tuple: (工具名, 参数字符串)，不是工具调用格式时返回None
+    """
+    match = _TOOL_CALL_RE.match(action)
+    if match is None:
+        return None
+    return match.group(1), match.group(2).strip()
+
+
+def parse_tool_params(params_str: str) -> Dict[str, Any]:
+    """
+    解析工具调用括号内的参数，例如 query="人工智能", top_k=5
+
+    优先按Python函数调用语法解析，字面量参数保留其类型（数字、布尔值、列表等），
+    无法作为字面量求值的参数保留源文本；语法解析失败时退回到正则逐个匹配 key=value。
+
+    Args:
+        params_str: 括号内的参数字符串
+
+    Returns:
+        dict: 参数名到参数值的映射
+    """
+    params: Dict[str, Any] = {}
+    if not params_str.strip():
+        return params
+
+    source = f"__f({params_str})"
+    try:
+        tree = ast.parse(source, mode='eval')
+        call = tree.body
+        if isinstance(call, ast.Call):
+            for keyword in call.keywords:
+                if keyword.arg is None:
+                    continue
+                try:
+                    params[keyword.arg] = ast.literal_eval(keyword.value)
+                except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+                    # 非字面量、不可哈希的字典键（如 {[1]: 2}）或嵌套过深时保留源文本
+                    segment = ast.get_source_segment(source, keyword.value)
+                    params[keyword.arg] = segment if segment is not None else ""
+            return params
+    except (SyntaxError, ValueError, MemoryError, RecursionError):
+        # 语法错误、包含空字符或嵌套过深导致无法解析时走正则回退
+        pass
+
+    # 回退：正则匹配 key=value，去掉值两端的引号
+    for match in _PARAM_RE.finditer(params_str):
+        value = match.group(2).strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in ("'", '"'):
+            value = value[1:-1]
+        params[match.group(1)] = value
+    return params
+
+
+__all__ = [
+    'PLAN_STEP_PREFIXES',
+    'strip_process_markers',
+    'extract_final_answer',
+    'clean_final_answer',
+    'FinalAnswerStream',
+    'parse_plan_with_reasoning',
+    'group_steps_into_waves',
+    'parse_execution_step',
+    'parse_execution_actions',
+    'split_tool_call',
+    'parse_tool_params'
+]
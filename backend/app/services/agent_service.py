@@ -6,23 +6,312 @@ Agent能够基于用户请求和可用工具，自主决策调用哪些工具来
 """
 
 import logging
-from typing import Dict, Any, List, Optional, Callable
+from typing import Dict, Any, List, Optional, Callable, AsyncIterator, Tuple
 from pydantic import BaseModel, Field
 import json
+import re
 import asyncio
-from functools import wraps
+import copy
+import datetime
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from weakref import WeakValueDictionary
+from functools import wraps, lru_cache
+
+from app.core.mcp import mcp_server, ToolDefinition, ToolResponse
+from app.services.llm_service import llm_service
+from app.services.plan_cache import plan_cache, PlanCache
+from app.services.agent_parsers import (
+    PLAN_STEP_PREFIXES,
+    extract_final_answer,
+    clean_final_answer,
+    FinalAnswerStream,
+    parse_plan_with_reasoning,
+    group_steps_into_waves,
+    parse_execution_actions,
+    split_tool_call,
+    parse_tool_params
+)
+from app.core.config import settings
 
-# LangChain 导入
-from langchain_core.tools import tool as langchain_tool
-from langchain.agents import AgentExecutor, create_react_agent
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.memory import ConversationBufferMemory
-from langchain.schema import SystemMessage, HumanMessage, AIMessage
+logger = logging.getLogger(__name__)
+# 执行器类在每次创建Agent执行器时重新定义，日志器在模块级预先获取，避免每个实例都查找日志器
+_EXECUTOR_LOGGER = logging.getLogger("PlanningThenExecutionExecutor")
+_FALLBACK_EXECUTOR_LOGGER = logging.getLogger("FallbackPlanningThenExecutionExecutor")
+
+# 尝试导入orjson加速工具结果序列化
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+    logger.info("orjson未安装，工具结果序列化使用标准json库")
+
+# 尝试导入pyahocorasick，用于在大模型输出中一次扫描匹配所有工具名
+try:
+    import ahocorasick
+    HAS_AHOCORASICK = True
+except ImportError:
+    HAS_AHOCORASICK = False
+    logger.info("pyahocorasick未安装，工具名匹配使用正则多选分支")
+
+# 请求中附加的用户ID信息，例如 "当前用户ID: user_123"
+_USER_ID_RE = re.compile(r'当前用户ID:\s*([a-zA-Z0-9_-]+)')
+
+# 最终回答中的视频信息块标签
+_VIDEO_INFO_OPEN = "<video_info>"
+_VIDEO_INFO_CLOSE = "</video_info>"
+
+# 可能需要调用工具的请求关键词（视频、音频、字幕、搜索、内容分析等），宁可多判也不漏判
+_TOOL_INTENT_RE = re.compile(
+    r'视频|影片|片段|video|音频|语音|audio|字幕|srt|转写|转录|'
+    r'搜索|查找|检索|找一下|找找|search|摘要|总结|分析|提取|工具|tool',
+    re.IGNORECASE
+)
+
+# 可直接用系统时间回答的日期/时间问题：处理函数键 -> 触发词
+_FAST_PATH_TRIGGERS: Dict[str, Tuple[str, ...]] = {
+    "date": ("今天几号", "日期"),
+    "time": ("现在几点", "时间"),
+}
+
+# 快速路径处理函数：处理函数键 -> (问题类型, 根据当前时间生成回答)
+_FAST_PATH_HANDLERS: Dict[str, Tuple[str, Callable[[datetime.datetime], str]]] = {
+    "date": ("日期", lambda now: f"今天是{now:%Y年%m月%d日}"),
+    "time": ("时间", lambda now: f"现在是{now:%H:%M:%S}"),
+}
+
+
+def _build_fast_path_matcher() -> Any:
+    """
+    构建快速路径触发词匹配器，模块导入时构建一次
+
+    Returns:
+        pyahocorasick自动机（值为处理函数键），未安装时为每个处理函数键一个命名分组的正则
+    """
+    if HAS_AHOCORASICK:
+        automaton = ahocorasick.Automaton()
+        for kind, triggers in _FAST_PATH_TRIGGERS.items():
+            for trigger in triggers:
+                automaton.add_word(trigger, kind)
+        automaton.make_automaton()
+        return automaton
+    return re.compile('|'.join(
+        f"(?P<{kind}>{'|'.join(re.escape(trigger) for trigger in triggers)})"
+        for kind, triggers in _FAST_PATH_TRIGGERS.items()
+    ))
 
-from app.core.mcp import mcp_server, ToolDefinition, ToolCall, ToolResponse
-from app.services.llm_service import VolcLLMService
 
-logger = logging.getLogger(__name__)
+_FAST_PATH_MATCHER = _build_fast_path_matcher()
+
+
+def _answer_datetime_question(request: str) -> Optional[str]:
+    """
+    直接用系统时间回答日期/时间问题（快速路径）
+
+    关键词都是中文，无需先 lower() 复制整个请求；一次扫描找出命中的触发词后按处理函数键分派。
+    同时问到日期和时间时按日期问题回答。
+
+    Args:
+        request: 用户请求
+
+    Returns:
+        str: 日期/时间回答，不是日期/时间问题时返回None
+    """
+    kind = None
+    if HAS_AHOCORASICK:
+        for _, trigger_kind in _FAST_PATH_MATCHER.iter(request):
+            kind = trigger_kind
+            if kind == "date":
+                break
+    else:
+        for fast_path_match in _FAST_PATH_MATCHER.finditer(request):
+            kind = fast_path_match.lastgroup
+            if kind == "date":
+                break
+    if kind is None:
+        return None
+    label, handler = _FAST_PATH_HANDLERS[kind]
+    direct_answer = handler(datetime.datetime.now())
+    logger.info(f"[系统回答] {label}问题: {direct_answer}")
+    return direct_answer
+
+
+def _needs_tools(user_input: str) -> bool:
+    """
+    快速判断请求是否可能需要调用工具
+
+    只检查规范化后的用户请求（不含附加的格式说明和用户ID），命中任一工具相关关键词即认为需要工具。
+
+    Args:
+        user_input: 原始用户输入
+
+    Returns:
+        bool: 可能需要工具时返回True
+    """
+    return bool(_TOOL_INTENT_RE.search(PlanCache.normalize(user_input)))
+
+
+def _split_video_info(text: str) -> Tuple[Optional[str], str]:
+    """
+    单次线性扫描拆分回答中的<video_info>块
+
+    Args:
+        text: 大模型回答
+
+    Returns:
+        (第一个视频信息块的内容，没有完整的块时为None, 移除所有视频信息块后的文本)
+    """
+    video_info = None
+    text_parts = []
+    pos = 0
+    while True:
+        start = text.find(_VIDEO_INFO_OPEN, pos)
+        if start == -1:
+            break
+        body_start = start + len(_VIDEO_INFO_OPEN)
+        end = text.find(_VIDEO_INFO_CLOSE, body_start)
+        if end == -1:
+            break
+        if video_info is None:
+            video_info = text[body_start:end]
+        text_parts.append(text[pos:start])
+        pos = end + len(_VIDEO_INFO_CLOSE)
+    if video_info is None:
+        return None, text
+    text_parts.append(text[pos:])
+    return video_info, "".join(text_parts)
+
+
+def _loads_json(text: str) -> Any:
+    """
+    解析JSON文本，安装了orjson时使用orjson
+
+    orjson.JSONDecodeError 是 json.JSONDecodeError 的子类，调用方按标准库异常捕获即可。
+    """
+    if HAS_ORJSON:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def _find_json_span(text: str) -> Optional[Tuple[int, int]]:
+    """
+    单次扫描找出文本中第一个括号配对完整的JSON数组或对象
+
+    跟踪字符串和转义状态，字符串值中的括号不参与配对。
+
+    Args:
+        text: 可能夹杂其他内容的JSON文本
+
+    Returns:
+        (起始位置, 结束位置) 的切片范围，没有完整的数组或对象时返回None
+    """
+    start = -1
+    depth = 0
+    in_string = False
+    escaped = False
+    for index, char in enumerate(text):
+        if start == -1:
+            if char == '[' or char == '{':
+                start = index
+                depth = 1
+            continue
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '[' or char == '{':
+            depth += 1
+        elif char == ']' or char == '}':
+            depth -= 1
+            if depth == 0:
+                return start, index + 1
+    return None
+
+
+def _serialize_tool_result(result: Any) -> str:
+    """
+    将工具返回结果序列化为写入提示词的字符串
+
+    字典、列表等结构化结果序列化为JSON，中文字符保持原样不做转义，以减少发送给大模型的token数。
+    工具直接返回的UTF-8字节（bytes/bytearray/memoryview）只在这里解码一次。
+
+    Args:
+        result: 工具返回结果
+
+    Returns:
+        str: 序列化后的结果字符串
+    """
+    if isinstance(result, str):
+        return result
+    if isinstance(result, (bytes, bytearray, memoryview)):
+        return str(result, "utf-8", "replace")
+    if HAS_ORJSON:
+        try:
+            return orjson.dumps(result, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            pass
+    try:
+        return json.dumps(result, ensure_ascii=False, default=str)
+    except (TypeError, ValueError):
+        return str(result)
+
+
+@lru_cache(maxsize=8)
+def _build_tool_matcher(tool_names: Tuple[str, ...]) -> Any:
+    """
+    为一组工具名构建多模式匹配器，工具集合不变时复用
+
+    Args:
+        tool_names: 工具名元组
+
+    Returns:
+        pyahocorasick自动机，未安装时为按长度降序排列的正则多选分支
+    """
+    if HAS_AHOCORASICK:
+        automaton = ahocorasick.Automaton()
+        for name in tool_names:
+            automaton.add_word(name, name)
+        automaton.make_automaton()
+        return automaton
+    return re.compile('|'.join(re.escape(name) for name in sorted(tool_names, key=len, reverse=True)))
+
+
+def _find_tool_mention(text: str, tool_names: Tuple[str, ...]) -> Optional[Tuple[str, int]]:
+    """
+    单次扫描查找文本中提到的工具名
+
+    优先返回紧跟 "(" 的工具调用，没有调用格式时返回最先出现的工具名。
+
+    Args:
+        text: 大模型输出
+        tool_names: 工具名元组
+
+    Returns:
+        (工具名, 工具名结束位置) 或 None
+    """
+    if not tool_names:
+        return None
+    matcher = _build_tool_matcher(tool_names)
+    if HAS_AHOCORASICK:
+        hits = ((name, end_index + 1) for end_index, name in matcher.iter(text))
+    else:
+        hits = ((match.group(0), match.end()) for match in matcher.finditer(text))
+    first_hit = None
+    for name, name_end in hits:
+        if text.startswith("(", name_end):
+            return name, name_end
+        if first_hit is None:
+            first_hit = (name, name_end)
+    return first_hit
 
 
 class AgentConfig(BaseModel):
@@ -37,85 +326,359 @@ class AgentConfig(BaseModel):
     temperature: float = Field(default=0.3, description="生成温度")
 
 
-# AgentState类已被移除，因为我们使用简化的实现
-# 不再需要复杂的状态管理
+# 附加在用户请求前后的视频信息返回格式说明（静态部分只构造一次，调用时直接拼接）
+_ENHANCED_REQUEST_PREFIX = "\n"
+_VIDEO_INFO_INSTRUCTION = """
+
+## 重要提示：如果你需要返回视频信息，请使用以下JSON格式：
+<video_info>
+[
+    {"video_id": "视频ID", "title": "视频标题", "thumbnail": "缩略图URL", "video_link": "视频链接", "relevance_score": 相关度分数}
+]
+</video_info>
+
+请严格按照上述格式返回视频信息。如果没有视频信息，请不要包含<video_info>标签。
+"""
+
+# Fallback执行器最终回答的格式要求
+_FALLBACK_SUMMARY_INSTRUCTIONS = """
+
+## 重要提示：最终回答格式
+1. **不要重复上述执行计划和步骤过程**
+2. **直接提供用户需要的答案或结果**
+3. 如果查询到视频信息：
+   - 简短说明找到的视频（1-2句话）
+   - 使用<video_info>标签返回视频信息（严格按照之前的JSON格式）
+4. 如果是对话回答：
+   - 直接给出简洁的回答
+   - 不要说"基于上述步骤"、"经过分析"等过程性描述
+
+请提供最终答案："""
+
+
+class ExecutionState:
+    """
+    单次Agent调用的执行状态
+
+    使用__slots__固定属性集合，按属性访问代替字典键查找。
+    results 在执行阶段开始时按步骤数预分配，按步骤序号（从1开始）减一索引。
+    """
+    __slots__ = (
+        "plan", "reasoning", "plan_dependencies", "results", "current_step",
+        "user_id", "tool_cache", "tool_used", "current_tool", "current_params",
+        "status", "final_answer", "plan_cache_pending", "plan_cache_vector",
+        "prefetched_steps", "tool_semaphore", "history_digest"
+    )
+
+    def __init__(self, user_id: Optional[str] = None, history_digest: str = ""):
+        self.plan: List[str] = []
+        self.reasoning: str = ""
+        self.plan_dependencies: Optional[List[Optional[List[int]]]] = None
+        self.results: List[Optional[str]] = []
+        self.current_step: int = 0
+        self.user_id: Optional[str] = user_id
+        self.tool_cache: Dict[tuple, str] = {}
+        self.tool_used: bool = False
+        self.current_tool: Optional[str] = None
+        self.current_params: Optional[Dict[str, Any]] = None
+        self.status: Optional[str] = None
+        self.final_answer: Optional[str] = None
+        # 本次新生成、待执行成功后写入计划缓存的计划及其请求向量
+        self.plan_cache_pending: bool = False
+        self.plan_cache_vector: Any = None
+        # 对话历史摘要，作为计划缓存和答案缓存键的一部分
+        self.history_digest: str = history_digest
+        # 规划阶段计划块结束后提前发起的执行行动生成：步骤编号 -> (执行步骤提示, asyncio.Task)
+        self.prefetched_steps: Dict[int, tuple] = {}
+        # 限制本次调用内并发执行的工具调用数，避免一批并发调用占满MCP工具线程池
+        self.tool_semaphore = asyncio.Semaphore(settings.agent_tool_max_concurrency)
+
+
+# 后台事件循环：在独立守护线程中常驻运行，供同步->异步桥接调用复用，
+# 避免每次调用都创建/销毁事件循环，并保留底层HTTP连接池
+_BG_LOOP = asyncio.new_event_loop()
+_BG_LOOP_THREAD = threading.Thread(target=_BG_LOOP.run_forever, name="agent-bg-loop", daemon=True)
+_BG_LOOP_THREAD.start()
+
+
+def _run_coro_sync(coro: Any) -> Any:
+    """
+    在后台事件循环中运行协程并同步等待结果（所有同步->异步桥接的统一入口）
+
+    不会修改调用线程的当前事件循环。
+
+    Args:
+        coro: 协程对象
+
+    Returns:
+        协程的返回值
+
+    Raises:
+        RuntimeError: 在后台事件循环线程内调用（同步等待会造成死锁）
+    """
+    if threading.current_thread() is _BG_LOOP_THREAD:
+        coro.close()
+        raise RuntimeError("不能在后台事件循环线程中同步等待协程")
+    return asyncio.run_coroutine_threadsafe(coro, _BG_LOOP).result()
 
 
 # 异步工具包装器
 def async_to_sync_wrapper(async_func: Callable) -> Callable:
     """
     将异步函数包装为同步函数，用于LangChain的工具调用
+
+    协程被提交到常驻的后台事件循环执行，调用线程阻塞等待结果。
     """
     @wraps(async_func)
     def wrapper(*args, **kwargs):
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            return loop.run_until_complete(async_func(*args, **kwargs))
-        finally:
-            loop.close()
+        return _run_coro_sync(async_func(*args, **kwargs))
     return wrapper
 
 
+@lru_cache(maxsize=None)
+def _load_structured_tool() -> Any:
+    """
+    按需导入LangChain的StructuredTool
+
+    LangChain依赖链很长，只有在为MCP工具构建执行器时才加载，
+    没有注册工具的进程和日期/时间等快速路径请求不会导入LangChain。
+
+    Returns:
+        StructuredTool 类
+    """
+    from langchain_core.tools import StructuredTool
+    return StructuredTool
+
+
+def _wrap_mcp_tool(name: str, description: str) -> Any:
+    """
+    将MCP工具包装为LangChain StructuredTool，工具名称和调用入口在创建时绑定
+
+    Args:
+        name: 工具名称
+        description: 工具描述
+
+    Returns:
+        StructuredTool 实例
+    """
+    call_tool = mcp_server.call_tool_async
+
+    async def tool_coroutine(**kwargs):
+        # 在当前事件循环中直接await MCP工具，并发调用不会互相阻塞
+        try:
+            result = await call_tool(name, kwargs)
+            # 工具返回UTF-8字节时在此边界处解码一次，其余类型原样交给LangChain
+            if isinstance(result.result, (bytes, bytearray, memoryview)):
+                return _serialize_tool_result(result.result)
+            return result.result
+        except Exception as e:
+            logger.error(f"Tool {name} call failed: {str(e)}")
+            return f"工具调用失败: {str(e)}"
+
+    def tool_function(**kwargs):
+        # LangChain强制同步调用时，提交到常驻后台事件循环执行
+        return _run_coro_sync(tool_coroutine(**kwargs))
+
+    return _load_structured_tool().from_function(
+        func=tool_function,
+        coroutine=tool_coroutine,
+        name=name,
+        description=description
+    )
+
+
+@lru_cache(maxsize=1)
+def _build_langchain_tools(tools_version: int) -> Tuple[Tuple[Any, ...], Dict[str, ToolDefinition]]:
+    """
+    包装所有已注册的MCP工具，按MCP工具注册表版本号缓存
+
+    工具注册表变化时版本号递增，下次调用重新包装；Agent创建和reset()不再重复包装工具。
+
+    Args:
+        tools_version: MCP工具注册表版本号
+
+    Returns:
+        tuple: (LangChain工具元组, 工具名称到工具定义的映射)
+    """
+    langchain_tools = []
+    tool_map = {}
+    for tool in mcp_server.get_available_tools():
+        tool_name = getattr(tool, 'name', 'unknown_tool')
+        tool_desc = getattr(tool, 'description', '无描述')
+        langchain_tools.append(_wrap_mcp_tool(tool_name, tool_desc))
+        tool_map[tool_name] = tool
+    return tuple(langchain_tools), tool_map
+
+
+@lru_cache(maxsize=4)
+def _render_tools_info(tools_version: int) -> str:
+    """
+    渲染可用工具信息字符串，按MCP工具注册表版本号缓存
+
+    Args:
+        tools_version: MCP工具注册表版本号，工具变化时缓存自动失效
+
+    Returns:
+        str: 包含所有工具信息的字符串
+    """
+    # 获取所有MCP注册的工具
+    mcp_tools = mcp_server.get_available_tools()
+    if not mcp_tools:
+        return "目前没有可用工具"
+    
+    result = "\n".join(tool.rendered_line for tool in mcp_tools)
+    logger.info(f"[工具信息] 已生成工具信息: {len(mcp_tools)}个工具")
+    return result
+
+
 # 简化的工具处理函数 - 获取基本的工具信息
 def get_available_tools_info() -> str:
     """
     获取可用工具的详细信息字符串
     
+    工具列表渲染结果按MCP注册表版本号缓存，只有工具注册变化时才重新生成。
+    
     Returns:
         str: 包含所有工具信息的字符串，包括名称、描述和示例调用方式
     """
     try:
-        # 获取所有MCP注册的工具
-        mcp_tools = mcp_server.get_available_tools()
-        if not mcp_tools:
-            return "目前没有可用工具"
-        
-        tools_info = []
-        for i, tool in enumerate(mcp_tools):
-            try:
-                # 安全访问工具名称和描述
-                tool_name = getattr(tool, 'name', f'工具{i+1}')
-                tool_desc = getattr(tool, 'description', '无描述')
-                
-                # 获取参数信息（如果有）
-                params_info = ""
-                if hasattr(tool, 'parameters') and tool.parameters:
-                    param_names = [param.get('name', '参数') for param in tool.parameters]
-                    params_info = f"(参数: {', '.join(param_names)})"
-                
-                # 添加工具信息，包括示例调用格式
-                tools_info.append(
-                    f"- {tool_name}: {tool_desc}\n"
-                    f"  调用格式示例: {tool_name}{params_info if params_info else '()'}"
-                )
-                logger.info(f"[工具信息] 已添加工具: {tool_name}")
-            except Exception as e:
-                logger.warning(f"[工具信息] 处理工具时出错: {str(e)}")
-                # 忽略无法处理的工具
-                continue
-        
-        if not tools_info:
-            logger.warning("[工具信息] 无法获取工具详细信息")
-            return "无法获取工具详细信息"
-        
-        result = "\n".join(tools_info)
-        logger.info(f"[工具信息] 已生成工具信息: {len(mcp_tools)}个工具")
-        return result
+        return _render_tools_info(mcp_server.tools_version)
     except Exception as e:
         logger.error(f"[工具信息] 获取工具列表失败: {str(e)}")
         # 如果无法获取工具列表，返回通用信息
         return "工具列表获取失败"
 
 
+@lru_cache(maxsize=32)
+def _render_system_prompt(agent_name: str, agent_role: str, tools_version: int) -> str:
+    """
+    渲染Agent系统提示词，按(名称, 角色, 工具注册表版本号)缓存
+
+    Args:
+        agent_name: Agent名称
+        agent_role: Agent角色
+        tools_version: MCP工具注册表版本号
+
+    Returns:
+        str: 格式化后的系统提示词
+    """
+    return Agent.SYSTEM_PROMPT_TEMPLATE.format(
+        agent_name=agent_name,
+        agent_role=agent_role,
+        tools_info=get_available_tools_info()
+    )
+
+
 class VolcLLMWrapper:
     """
     火山引擎LLM包装器，适配LangChain接口
     """
+
+    # 所有包装器实例共享的响应缓存：键 -> (写入时间, 生成文本)，按写入顺序排列。
+    # 请求事件循环和后台事件循环（同步invoke）所在的线程都会读写，访问时持有线程锁
+    _response_cache: Dict[str, Tuple[float, str]] = {}
+    _response_cache_lock = threading.Lock()
+    # 进行中的调用按事件循环分开记录：事件循环 -> {键 -> asyncio.Task}。
+    # 任务只能在创建它的事件循环中等待，每个内层字典只由对应事件循环所在的线程访问
+    _inflight: Dict[Any, Dict[str, "asyncio.Task"]] = {}
     
     def __init__(self, temperature: float = 0.3):
         self.temperature = temperature
-        self.llm_service = VolcLLMService()
+        # 所有Agent共享全局LLM服务实例（同一个客户端和连接池）
+        self.llm_service = llm_service
+
+    @staticmethod
+    def _prepare_messages(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        整理发送给大模型的消息列表，保持消息边界和顺序不变
+
+        静态的系统提示始终是第一条消息，动态的对话历史和执行历史放在其后的用户消息中，
+        相同前缀在多次调用间逐字节一致，便于服务端复用前缀缓存。
+
+        Args:
+            messages: 消息列表，每个消息包含role和content
+
+        Returns:
+            list: 只包含system/user/assistant消息的列表
+        """
+        return [
+            {"role": message["role"], "content": message.get("content") or ""}
+            for message in messages
+            if message.get("role") in ("system", "user", "assistant")
+        ]
+
+    def _cache_key(self, messages: List[Dict[str, str]]) -> str:
+        digest = hashlib.blake2b(digest_size=16)
+        for message in messages:
+            digest.update(message["role"].encode("utf-8"))
+            digest.update(b"\x00")
+            digest.update(message["content"].encode("utf-8"))
+            digest.update(b"\x01")
+        digest.update(f"|{self.temperature}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[str]:
+        """读取未过期的缓存结果，已过期的条目直接删除"""
+        with self._response_cache_lock:
+            entry = self._response_cache.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] < settings.agent_llm_cache_ttl:
+                return entry[1]
+            del self._response_cache[key]
+            return None
+
+    def _cache_put(self, key: str, text: str) -> None:
+        """写入缓存结果，超过容量上限时淘汰最旧的条目"""
+        with self._response_cache_lock:
+            cache = self._response_cache
+            if key not in cache and len(cache) >= settings.agent_llm_cache_max_entries:
+                # 字典按写入顺序排列，第一个即最旧的条目
+                del cache[next(iter(cache))]
+            cache[key] = (time.monotonic(), text)
+
+    async def _generate_cached(self, messages: List[Dict[str, str]]) -> str:
+        """
+        带响应缓存和请求合并的异步生成
+
+        未过期的缓存结果直接返回；相同请求正在进行时等待同一个任务，不再重复调用大模型。
+        只缓存成功的结果，调用失败时异常照常抛给所有等待者。
+        """
+        if not settings.agent_llm_cache_enabled:
+            return await self.llm_service.generate_async(
+                messages=messages,
+                temperature=self.temperature
+            )
+
+        key = self._cache_key(messages)
+        cached = self._cache_get(key)
+        if cached is not None:
+            logger.info("[VolcLLMWrapper] 命中大模型响应缓存")
+            return cached
+
+        # 只在当前事件循环的进行中任务里合并（同步invoke走后台事件循环，与请求事件循环分开）
+        inflight = self._inflight.setdefault(asyncio.get_running_loop(), {})
+        task = inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.llm_service.generate_async(
+                messages=messages,
+                temperature=self.temperature
+            ))
+            inflight[key] = task
+
+            def _on_done(done_task: "asyncio.Task") -> None:
+                if inflight.get(key) is done_task:
+                    del inflight[key]
+                if done_task.cancelled() or done_task.exception() is not None:
+                    return
+                self._cache_put(key, done_task.result())
+
+            task.add_done_callback(_on_done)
+        else:
+            logger.info("[VolcLLMWrapper] 合并到进行中的相同大模型调用")
+
+        # shield：某个等待者被取消时不影响其他等待同一任务的调用
+        return await asyncio.shield(task)
     
     def invoke(self, messages: List[Dict[str, str]]) -> str:
         """
@@ -127,34 +690,8 @@ class VolcLLMWrapper:
         Returns:
             str: 生成的文本
         """
-        # 提取系统提示和用户提示
-        system_prompt = None
-        user_prompts = []
-        
-        for message in messages:
-            if message.get("role") == "system":
-                system_prompt = message.get("content", "")
-            elif message.get("role") == "user":
-                user_prompts.append(message.get("content", ""))
-        
-        # 合并用户提示
-        prompt = "\n".join(user_prompts)
-        
-        # 调用LLM服务
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            result = loop.run_until_complete(
-                self.llm_service.generate_async(
-                    system_prompt=system_prompt,
-                    prompt=prompt,
-                    temperature=self.temperature
-                )
-            )
-            logger.info(f"[VolcLLMWrapper-sync] 大模型返回结果: 长度={len(result)}")
-            return result
-        finally:
-            loop.close()
+        # 同步接口只是异步路径的薄封装，提交到常驻后台事件循环执行（共享响应缓存）
+        return _run_coro_sync(self.ainvoke(messages))
     
     async def ainvoke(self, messages: List[Dict[str, str]]) -> str:
         """
@@ -166,28 +703,56 @@ class VolcLLMWrapper:
         Returns:
             str: 生成的文本
         """
-        # 提取系统提示和用户提示
-        system_prompt = None
-        user_prompts = []
+        messages = self._prepare_messages(messages)
         
-        for message in messages:
-            if message.get("role") == "system":
-                system_prompt = message.get("content", "")
-            elif message.get("role") == "user":
-                user_prompts.append(message.get("content", ""))
+        # 调用LLM服务的异步方法
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("[VolcLLMWrapper] 调用火山引擎大模型: 消息数=%d, 输入长度=%d",
+                        len(messages), sum(len(m['content']) for m in messages))
+        result = await self._generate_cached(messages)
+        logger.info("[VolcLLMWrapper] 大模型返回结果: 长度=%d", len(result))
+        return result
+    
+    async def astream(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        """
+        异步流式调用LLM模型
+
+        与ainvoke共享响应缓存：命中时把缓存的完整文本作为一个片段返回；
+        只有完整读完的流才写入缓存，调用方提前停止读取时不缓存不完整的输出。
         
-        # 合并用户提示
-        prompt = "\n".join(user_prompts)
+        Args:
+            messages: 消息列表，每个消息包含role和content
+            
+        Yields:
+            str: 生成文本的增量片段
+        """
+        messages = self._prepare_messages(messages)
+
+        key = self._cache_key(messages) if settings.agent_llm_cache_enabled else None
+        if key is not None:
+            cached = self._cache_get(key)
+            if cached is not None:
+                logger.info("[VolcLLMWrapper] 流式调用命中大模型响应缓存")
+                yield cached
+                return
         
-        # 调用LLM服务的异步方法
-        logger.info(f"[VolcLLMWrapper] 调用火山引擎大模型: prompt长度={len(prompt)}, 有系统提示={system_prompt is not None}")
-        result = await self.llm_service.generate_async(
-            system_prompt=system_prompt,
-            prompt=prompt,
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("[VolcLLMWrapper] 流式调用火山引擎大模型: 消息数=%d, 输入长度=%d",
+                        len(messages), sum(len(m['content']) for m in messages))
+        stream = self.llm_service.generate_stream_async(
+            messages=messages,
             temperature=self.temperature
         )
-        logger.info(f"[VolcLLMWrapper] 大模型返回结果: 长度={len(result)}")
-        return result
+        chunks = []
+        try:
+            async for delta in stream:
+                chunks.append(delta)
+                yield delta
+            if key is not None:
+                self._cache_put(key, "".join(chunks))
+        finally:
+            # 调用方提前停止读取时立即关闭上游流（停止接收剩余输出），不等待垃圾回收
+            await stream.aclose()
 
 
 class Agent:
@@ -239,9 +804,11 @@ class Agent:
 ### Planning阶段输出格式：
 
 Plan:
-1. [第一步计划] - [预期工具/方法]
-2. [第二步计划] - [预期工具/方法]
-3. [更多步骤...] - [预期工具/方法]
+1. [第一步计划] - [预期工具/方法] (依赖: 无)
+2. [第二步计划] - [预期工具/方法] (依赖: 1)
+3. [更多步骤...] - [预期工具/方法] (依赖: ...)
+
+每个步骤末尾用"(依赖: 步骤编号)"标明需要用到哪些前序步骤的结果，不依赖任何步骤时写"(依赖: 无)"。互不依赖的步骤会被并行执行。
 
 Reasoning: [为什么这样规划，简要说明逻辑]
 
@@ -265,6 +832,8 @@ Action: [调用工具的格式或直接回答]
    - 直接回答格式: Direct[回答内容]  [用于通用问答]
 Result: [工具执行结果或直接回答的确认]
 
+同一步骤需要多个互不依赖的工具调用时，可以连续写多行"Action: 工具调用"，这些调用会被并行执行。
+
 **选择Action类型的原则**：
 - 用户问题明确涉及视频内容 → 使用工具调用
 - 用户问题是通用知识、对话、建议等 → 使用Direct直接回答
@@ -323,23 +892,34 @@ Final Answer: [对用户问题的最终回答]
             config: Agent配置
         """
         self.config = config or AgentConfig()
+        # Agent实例ID，可通过 AgentService.get_agent 查找
+        self.agent_id = uuid.uuid4().int
         self.logger = logger.getChild(f"agent.{self.config.name}")
 
         # 生成系统提示词
         self.system_prompt = self._generate_system_prompt()
 
-        # 初始化Agent执行器
-        self.agent_executor = self._create_agent_executor()
+        # 初始化Agent执行器（工具包装、LLM包装器和提示词只构建一次，由各次请求共享）
+        self._agent_executor = self._create_agent_executor()
 
         self.logger.info(f"Simplified Agent initialized: {self.config.name}")
 
+    @property
+    def agent_executor(self) -> object:
+        """
+        获取Agent执行器
+
+        共享的Agent实例会被并发请求同时使用，而执行器在每次调用时会重新绑定执行状态和事件队列，
+        因此每次访问返回共享执行器的浅拷贝：构建好的工具、LLM包装器等对象仍然共享，单次调用的状态互不干扰。
+        """
+        return copy.copy(self._agent_executor)
+
     def _generate_system_prompt(self) -> str:
         """生成系统提示词"""
-        tools_info = get_available_tools_info()
-        return self.SYSTEM_PROMPT_TEMPLATE.format(
-            agent_name=self.config.name,
-            agent_role=self.config.role,
-            tools_info=tools_info
+        return _render_system_prompt(
+            self.config.name,
+            self.config.role,
+            mcp_server.tools_version
         )
     
     def _create_agent_executor(self) -> object:
@@ -350,60 +930,8 @@ Final Answer: [对用户问题的最终回答]
             object: 真正的React模式Agent执行器
         """
         try:
-            # 获取所有可用的MCP工具
-            mcp_tools = mcp_server.get_available_tools()
-            
-            # 转换MCP工具为LangChain工具
-            langchain_tools = []
-            
-            # 工具名称到工具对象的映射，用于后续直接调用
-            tool_map = {}
-            
-            for tool in mcp_tools:
-                # 为每个工具单独创建包装函数
-                tool_name = getattr(tool, 'name', 'unknown_tool')
-                tool_desc = getattr(tool, 'description', '无描述')
-                
-                # 使用工厂函数创建工具函数，避免闭包问题
-                def create_tool_wrapper(tool_obj):
-                    @langchain_tool
-                    def tool_function(**kwargs):
-                        # 调用MCP工具
-                        try:
-                            # 使用同步方式调用异步的MCP工具
-                            loop = asyncio.new_event_loop()
-                            asyncio.set_event_loop(loop)
-
-                            tool_call = ToolCall(
-                                tool_name=getattr(tool_obj, 'name', 'unknown_tool'),
-                                parameters=kwargs
-                            )
-
-                            # 同步运行异步函数
-                            result = loop.run_until_complete(
-                                mcp_server.call_tool_async(
-                                    tool_name=tool_call.tool_name,
-                                    parameters=tool_call.parameters
-                                )
-                            )
-                            return result.result
-                        except Exception as e:
-                            logger.error(f"Tool {getattr(tool_obj, 'name', 'unknown')} call failed: {str(e)}")
-                            return f"工具调用失败: {str(e)}"
-                        finally:
-                            loop.close()
-                    return tool_function
-
-                # 为当前工具创建特定的函数
-                create_tool_function = create_tool_wrapper(tool)
-                
-                # 更新函数的名称和描述
-                create_tool_function.__name__ = tool_name
-                create_tool_function.__doc__ = tool_desc
-                
-                # 添加到工具列表和映射
-                langchain_tools.append(create_tool_function)
-                tool_map[tool_name] = tool
+            # MCP工具包装为LangChain工具，按工具注册表版本号缓存，同一版本的所有Agent共享
+            langchain_tools, tool_map = _build_langchain_tools(mcp_server.tools_version)
             
             # 使用统一的系统提示词
             planning_execution_prompt = self.system_prompt
@@ -417,64 +945,103 @@ Final Answer: [对用户问题的最终回答]
                     self.config = agent_config
                     self.tools = tools
                     self.tool_map = tool_mapping
+                    # 工具集合在执行器生命周期内不变，预先缓存工具名元组和集合
+                    self._tool_names = tuple(self.tool_map)
+                    self._tool_name_set = frozenset(self._tool_names)
                     self.llm = llm_wrapper
-                    self.logger = logging.getLogger(f"PlanningThenExecutionExecutor")
-                    self.execution_state = {}
+                    self.logger = _EXECUTOR_LOGGER
+                    self.execution_state = ExecutionState()
                     self.current_step = 0
+                    # 流式事件队列，由后台任务统一转发给stream_callback
+                    self._evt_queue = None
                     
+                def _emit(self, event):
+                    """提交流式事件（非阻塞），未开启流式输出时直接忽略"""
+                    if self._evt_queue is not None:
+                        self._evt_queue.put_nowait(event)
+
+                async def _drain_events(self, queue, stream_callback):
+                    """按提交顺序将队列中的事件交给stream_callback，收到None时结束"""
+                    while True:
+                        event = await queue.get()
+                        if event is None:
+                            break
+                        try:
+                            await stream_callback(event)
+                        except Exception as e:
+                            self.logger.error("[ainvoke] 发送流式事件失败: %s", e)
+
                 async def ainvoke(self, inputs):
                     # 获取输入参数
                     user_input = inputs.get("input", "")
                     chat_history = inputs.get("chat_history", [])
                     stream_callback = inputs.get("stream_callback", None)  # 新增流式回调
 
-                    self.logger.info(f"[ainvoke] 被调用, user_input={user_input[:50]}...")
-                    self.logger.info(f"[ainvoke] stream_callback 是否存在: {stream_callback is not None}")
+                    self.logger.info("[ainvoke] 被调用, user_input=%.50s...", user_input)
+                    self.logger.info("[ainvoke] stream_callback 是否存在: %s", stream_callback is not None)
 
                     # 从 user_input 中提取 user_id
-                    import re
-                    user_id_match = re.search(r'当前用户ID:\s*([a-zA-Z0-9_-]+)', user_input)
+                    user_id_match = _USER_ID_RE.search(user_input)
                     extracted_user_id = user_id_match.group(1) if user_id_match else None
                     if extracted_user_id:
-                        self.logger.info(f"[Planning] 从输入中提取到用户ID: {extracted_user_id}")
+                        self.logger.info("[Planning] 从输入中提取到用户ID: %s", extracted_user_id)
+
+                    # 初始化对话历史和执行状态：对话历史只读，直接渲染一次供规划和执行阶段共用，不复制列表
+                    dialog_text = "".join(
+                        [f"{msg['role']}: {msg['content']}\n" for msg in chat_history]
+                        + [f"user: {user_input}\n"]
+                    )
+                    self.execution_state = ExecutionState(
+                        user_id=extracted_user_id,
+                        history_digest=plan_cache.digest_history(chat_history)
+                    )
 
-                    # 初始化对话历史和执行状态
-                    dialog_history = chat_history.copy()
-                    dialog_history.append({"role": "user", "content": user_input})
-                    self.execution_state = {"plan": [], "results": {}, "current_step": 0, "user_id": extracted_user_id}
+                    # 流式事件统一放入队列，由单个后台任务按顺序转发，执行流程无需等待回调
+                    drain_task = None
+                    if stream_callback:
+                        self._evt_queue = asyncio.Queue()
+                        drain_task = asyncio.create_task(self._drain_events(self._evt_queue, stream_callback))
+                    else:
+                        self.logger.warning("[ainvoke] stream_callback 不存在，不发送流式事件")
 
                     try:
-                        # ======== Planning阶段 ========
-                        import time
-                        callback_start = time.time()
-                        if stream_callback:
-                            self.logger.info(f"[ainvoke] [{time.time():.2f}] 准备调用 stream_callback - planning_start")
-                            await stream_callback({
-                                "type": "planning_start",
-                                "message": "开始规划阶段..."
+                        if not self._tool_name_set:
+                            # 没有注册任何MCP工具时不可能调用工具，跳过规划和逐步执行，一次大模型调用直接回答
+                            self.logger.info("[Planning-then-Execution模式] 未注册任何工具，跳过规划和执行阶段直接回答")
+                            final_result = await self._direct_answer(dialog_text)
+                            self._emit({
+                                "type": "complete",
+                                "final_answer": final_result
                             })
-                            # 关键：显式yield控制权给事件循环，让队列数据被消费
-                            await asyncio.sleep(0)
-                            self.logger.info(f"[ainvoke] [{time.time():.2f}] stream_callback 调用完成 - planning_start (耗时: {time.time()-callback_start:.3f}s)")
-                        else:
-                            self.logger.warning("[ainvoke] stream_callback 不存在，跳过 planning_start")
+                            return {"output": final_result}
 
-                        plan_steps, plan_reasoning = await self._planning_phase(
-                            user_input, dialog_history
-                        )
+                        # ======== Planning阶段 ========
+                        self._emit({
+                            "type": "planning_start",
+                            "message": "开始规划阶段..."
+                        })
+
+                        if settings.agent_fast_path_enabled and not chat_history and not _needs_tools(user_input):
+                            # 与视频和工具无关的一般性问题，跳过规划阶段的大模型调用，直接回答
+                            self.logger.info("[Planning-then-Execution模式] 请求不需要工具，跳过规划阶段")
+                            plan_steps, plan_reasoning = ["直接回答用户问题"], "请求与视频内容和可用工具无关，直接回答即可"
+                            self.execution_state.plan = plan_steps
+                            self.execution_state.reasoning = plan_reasoning
+                        else:
+                            plan_steps, plan_reasoning = await self._planning_phase(
+                                user_input, dialog_text
+                            )
 
                         if not plan_steps:
                             self.logger.error("[Planning-then-Execution模式] 无法生成有效的执行计划")
                             return {"output": "无法生成有效的执行计划，请重试。"}
 
                         # 发送规划结果
-                        if stream_callback:
-                            await stream_callback({
-                                "type": "planning_complete",
-                                "plan": plan_steps,
-                                "reasoning": plan_reasoning
-                            })
-                            await asyncio.sleep(0)  # Yield控制权
+                        self._emit({
+                            "type": "planning_complete",
+                            "plan": plan_steps,
+                            "reasoning": plan_reasoning
+                        })
 
                         # 保存计划信息
                         execution_history = [
@@ -484,536 +1051,798 @@ Final Answer: [对用户问题的最终回答]
                         ]
 
                         # ======== Execution阶段 ========
-                        if stream_callback:
-                            await stream_callback({
-                                "type": "execution_start",
-                                "message": "开始执行阶段...",
-                                "total_steps": len(plan_steps)
-                            })
-                            await asyncio.sleep(0)  # Yield控制权
+                        self._emit({
+                            "type": "execution_start",
+                            "message": "开始执行阶段...",
+                            "total_steps": len(plan_steps)
+                        })
 
                         final_result = await self._execution_phase(
                             user_input,
-                            dialog_history,
+                            dialog_text,
                             execution_history,
                             plan_steps,
-                            stream_callback  # 传递回调
+                            self.execution_state.plan_dependencies
                         )
 
+                        # 至少有一个步骤成功产生结果时，将新生成的计划写入缓存
+                        state = self.execution_state
+                        if state.plan_cache_pending and any(result is not None for result in state.results):
+                            plan_cache.put_plan(
+                                user_input,
+                                plan_steps,
+                                plan_reasoning,
+                                state.plan_cache_vector,
+                                state.plan_dependencies,
+                                state.history_digest
+                            )
+
                         # 发送完成信号
-                        if stream_callback:
-                            await stream_callback({
-                                "type": "complete",
-                                "final_answer": final_result
-                            })
+                        self._emit({
+                            "type": "complete",
+                            "final_answer": final_result
+                        })
 
                         return {"output": final_result}
 
                     except Exception as e:
-                        self.logger.error(f"[Planning-then-Execution模式] 执行过程出错: {str(e)}")
-                        if stream_callback:
-                            await stream_callback({
-                                "type": "error",
-                                "error": str(e)
-                            })
+                        self.logger.error("[Planning-then-Execution模式] 执行过程出错: %s", e)
+                        self._emit({
+                            "type": "error",
+                            "error": str(e)
+                        })
                         return {"output": f"执行过程中发生错误: {str(e)}。请稍后重试。"}
+                    finally:
+                        # 未被执行阶段使用的提前生成任务直接取消
+                        prefetched_steps = self.execution_state.prefetched_steps
+                        for _, task in prefetched_steps.values():
+                            task.cancel()
+                        prefetched_steps.clear()
+                        # 等待已提交的事件全部发送完毕再返回，保证调用方后续事件的顺序
+                        if drain_task is not None:
+                            self._evt_queue.put_nowait(None)
+                            self._evt_queue = None
+                            await drain_task
                 
-                async def _planning_phase(self, user_input, dialog_history):
-                    """Planning阶段：生成详细执行计划"""
-                    self.logger.info(f"[Planning-then-Execution模式] 开始Planning阶段")
+                async def _planning_phase(self, user_input, dialog_text):
+                    """Planning阶段：生成详细执行计划
+
+                    Args:
+                        user_input: 用户输入
+                        dialog_text: 已渲染的对话历史（每行 "role: content"）
+                    """
+                    self.logger.info("[Planning-then-Execution模式] 开始Planning阶段")
                     
-                    # 构建规划提示
-                    planning_prompt = planning_execution_prompt
-                    planning_prompt += "\n\n对话历史:\n"
-                    for msg in dialog_history:
-                        planning_prompt += f"{msg['role']}: {msg['content']}\n"
+                    # 查询计划缓存，命中时跳过规划阶段的大模型调用
+                    cache_vector = None
+                    if settings.agent_plan_cache_enabled:
+                        lookup_start = time.perf_counter()
+                        cached_plan, cache_vector = await plan_cache.get_plan(
+                            user_input, self.execution_state.history_digest
+                        )
+                        if cached_plan:
+                            plan_steps, reasoning, plan_dependencies = cached_plan
+                            self.logger.info(
+                                f"[Planning-then-Execution模式] 命中计划缓存，复用{len(plan_steps)}个步骤，"
+                                f"耗时{(time.perf_counter() - lookup_start) * 1000:.1f}ms"
+                            )
+                            self.execution_state.plan = plan_steps
+                            self.execution_state.reasoning = reasoning
+                            self.execution_state.plan_dependencies = plan_dependencies
+                            return plan_steps, reasoning
                     
-                    planning_prompt += "\n请生成详细的执行计划。"
+                    # 构建规划提示：静态系统提示词单独作为system消息，保证跨调用字节一致以命中服务端前缀缓存
+                    planning_prompt = f"对话历史:\n{dialog_text}\n请生成详细的执行计划。"
                     
                     # 调用LLM生成执行计划
-                    plan_response = await self.llm.ainvoke([
-                        {"role": "system", "content": planning_prompt}
-                    ])
+                    plan_messages = [
+                        {"role": "system", "content": planning_execution_prompt},
+                        {"role": "user", "content": planning_prompt}
+                    ]
+                    if settings.agent_plan_streaming_enabled:
+                        plan_response = await self._stream_plan(plan_messages, dialog_text)
+                    else:
+                        plan_response = await self.llm.ainvoke(plan_messages)
                     
-                    self.logger.info(f"[Planning-then-Execution模式] 规划结果: {plan_response[:150]}...")
+                    self.logger.info("[Planning-then-Execution模式] 规划结果: %.150s...", plan_response)
                     
-                    # 解析计划和推理
-                    plan_steps, reasoning = self._parse_plan_with_reasoning(plan_response)
+                    # 解析计划、推理和步骤依赖关系
+                    plan_steps, reasoning, plan_dependencies = parse_plan_with_reasoning(plan_response)
                     
                     # 保存到执行状态
-                    self.execution_state["plan"] = plan_steps
-                    self.execution_state["reasoning"] = reasoning
+                    self.execution_state.plan = plan_steps
+                    self.execution_state.reasoning = reasoning
+                    self.execution_state.plan_dependencies = plan_dependencies
+                    
+                    # 计划在执行成功后才写入缓存，避免缓存无法执行的计划
+                    self.execution_state.plan_cache_pending = settings.agent_plan_cache_enabled and bool(plan_steps)
+                    self.execution_state.plan_cache_vector = cache_vector
                     
                     return plan_steps, reasoning
                     
-                async def _execution_phase(self, user_input, dialog_history, execution_history, plan_steps, stream_callback=None):
-                    """Execution阶段：执行计划并生成最终结果"""
-                    self.logger.info(f"[Planning-then-Execution模式] 开始Execution阶段，共{len(plan_steps)}个步骤")
-
-                    # 执行每个计划步骤
-                    for step_num, step_description in enumerate(plan_steps, 1):
-                        self.current_step = step_num
-                        self.logger.info(f"[Planning-then-Execution模式] 执行步骤 {step_num}/{len(plan_steps)}: {step_description}")
-
-                        # 发送步骤开始事件
-                        if stream_callback:
-                            await stream_callback({
-                                "type": "step_start",
-                                "step_number": step_num,
-                                "step_description": step_description,
-                                "total_steps": len(plan_steps)
-                            })
-                        
-                        # 构建执行步骤的提示
-                        execution_prompt = planning_execution_prompt
-                        execution_prompt += "\n\n对话历史:\n"
-                        for msg in dialog_history:
-                            execution_prompt += f"{msg['role']}: {msg['content']}\n"
-                        
-                        execution_prompt += "\n执行历史:\n"
-                        for entry in execution_history:
-                            execution_prompt += f"{entry}\n"
-                        
-                        # 添加当前步骤信息
-                        execution_prompt += f"\n当前执行阶段 - 需要执行的步骤:\n{step_num}. {step_description}"
-                        
-                        # 调用LLM生成当前步骤的行动
-                        self.logger.info(f"[Planning-then-Execution模式] 为步骤 {step_num} 生成执行行动")
-                        step_response = await self.llm.ainvoke([
-                            {"role": "system", "content": execution_prompt}
-                        ])
-                        
-                        # 解析步骤响应
-                        step_info, action = self._parse_execution_step(step_response)
-                        
-                        if not action:
-                            self.logger.error(f"[Planning-then-Execution模式] 无法解析步骤 {step_num} 的响应格式")
-                            # 生成更明确的提示，引导使用工具
-                            recovery_prompt = execution_prompt
-                            recovery_prompt += "\n\n警告：之前的输出格式不正确。请按照指定格式输出，特别是对于需要获取外部信息的任务，请使用工具调用格式。\n"
-                            recovery_prompt += f"可用工具: {list(self.tool_map.keys())}\n"
-                            
-                            # 重新获取响应
-                            self.logger.info(f"[Planning-then-Execution模式] 尝试恢复步骤 {step_num} 的执行")
-                            step_response = await self.llm.ainvoke([
-                                {"role": "system", "content": recovery_prompt}
-                            ])
-                            # 再次尝试解析
-                            step_info, action = self._parse_execution_step(step_response)
-                            
-                            if not action:
-                                self.logger.error(f"[Planning-then-Execution模式] 恢复失败，跳过步骤 {step_num}")
-                                continue
-                        
-                        # 更新执行历史
-                        execution_history.append(f"Step: {step_info}")
-                        execution_history.append(f"Action: {action}")
-                        
-                        # 检查是否为直接回答
-                        if action.startswith("Direct[") and action.endswith("]"):
-                            # 提取直接回答
-                            direct_answer = action[7:-1].strip()
-                            execution_history.append(f"Result: {direct_answer}")
-                            self.execution_state["results"][step_num] = direct_answer
-                            self.logger.info(f"[Planning-then-Execution模式] 步骤 {step_num} 直接回答: {direct_answer}")
-
-                            # 发送步骤完成事件（不包含执行细节）
-                            if stream_callback:
-                                await stream_callback({
-                                    "type": "step_complete",
-                                    "step_number": step_num
-                                })
-
-                            # 添加直接回答的原因记录，便于调试
-                            self.logger.info(f"[Planning-then-Execution模式] 步骤 {step_num} 使用直接回答，跳过工具调用")
-                        else:
-                            # 验证是否为有效的工具调用格式
-                            if "(" not in action or ")" not in action:
-                                self.logger.warning(f"[Planning-then-Execution模式] 步骤 {step_num} 工具调用格式可能不正确: {action}")
-                                # 尝试规范化工具调用格式
-                                tool_name_candidate = action.strip()
-                                if tool_name_candidate in self.tool_map:
-                                    self.logger.info(f"[Planning-then-Execution模式] 规范化工具调用格式")
-                                    action = f"{tool_name_candidate}()"
-
-                            # 尝试调用工具
-                            self.logger.info(f"[Planning-then-Execution模式] 准备调用工具: {action}")
-                            tool_result = await self._execute_tool(action)
-                            execution_history.append(f"Result: {tool_result}")
-                            self.execution_state["results"][step_num] = tool_result
-
-                            # 发送步骤完成事件（不包含执行细节）
-                            if stream_callback:
-                                await stream_callback({
-                                    "type": "step_complete",
-                                    "step_number": step_num
+                async def _stream_plan(self, messages, dialog_text):
+                    """
+                    流式生成执行计划
+
+                    每解析出一个完整的步骤行就发送 plan_step 事件；计划块结束（Reasoning: 开始）时
+                    计划步骤和依赖关系已经确定，立即在后台为第一批执行的步骤生成执行行动，与推理部分的生成重叠。
+                    步骤数超过 max_steps 时提前结束生成（多出的步骤在执行阶段也会被截断）。
+                    流式调用在输出任何内容前失败时退回普通调用。
+
+                    Returns:
+                        str: 计划文本
+                    """
+                    chunks = []
+                    pending = ""
+                    step_count = 0
+                    in_plan = False
+                    stream = self.llm.astream(messages)
+                    try:
+                        async for delta in stream:
+                            chunks.append(delta)
+                            pending += delta
+                            # 只处理已经完整的行，最后一段留到下一个增量
+                            *lines, pending = pending.split("\n")
+                            for line in lines:
+                                # 只解析 Plan: 块中的编号行：Reasoning: 开始后计划块结束，推理部分中的编号列表不算步骤
+                                if "Reasoning:" in line:
+                                    if in_plan and step_count:
+                                        self._prefetch_plan_steps("".join(chunks), dialog_text)
+                                    in_plan = False
+                                    continue
+                                if not in_plan:
+                                    in_plan = "Plan:" in line
+                                    continue
+                                # 与 parse_plan_with_reasoning 一致，缩进的编号行是子项，不算步骤
+                                if not line.startswith(PLAN_STEP_PREFIXES):
+                                    continue
+                                steps, _, _ = parse_plan_with_reasoning(f"Plan:\n{line}")
+                                if not steps:
+                                    continue
+                                if step_count >= self.config.max_steps:
+                                    self.logger.info("[Planning-then-Execution模式] 计划步骤已达上限 %s，提前结束计划生成", step_count)
+                                    return "".join(chunks)
+                                step_count += 1
+                                self._emit({
+                                    "type": "plan_step",
+                                    "step_number": step_count,
+                                    "step_description": steps[0]
                                 })
+                    except Exception as e:
+                        if chunks:
+                            raise
+                        self.logger.warning("[Planning-then-Execution模式] 流式生成计划失败，改用普通调用: %s", e)
+                        return await self.llm.ainvoke(messages)
+                    finally:
+                        await stream.aclose()
+                    return "".join(chunks)
+
+                async def _generate_step_response(self, messages):
+                    """
+                    流式生成步骤行动，"Action:" 之后一出现 "Result:" 就停止生成
+
+                    解析步骤响应时 "Result:" 之后的内容本来就会被丢弃（结果由工具执行产生），
+                    提前关闭流可以省去这部分的生成时间和token。流式调用在输出任何内容前失败时退回普通调用。
+
+                    Returns:
+                        str: 截止到 "Result:"（含）的步骤响应文本
+                    """
+                    text = ""
+                    action_pos = -1
+                    stream = self.llm.astream(messages)
+                    try:
+                        async for delta in stream:
+                            # 新增量可能与上一段拼接出标记，从上一段末尾留出标记长度开始查找
+                            search_from = max(len(text) - 7, 0)
+                            text += delta
+                            if action_pos == -1:
+                                action_pos = text.find("Action:", search_from)
+                                if action_pos == -1:
+                                    continue
+                                search_from = action_pos + 7
+                            if text.find("Result:", max(search_from, action_pos + 7)) != -1:
+                                break
+                    except Exception as e:
+                        if text:
+                            raise
+                        self.logger.warning("[Planning-then-Execution模式] 流式生成步骤行动失败，改用普通调用: %s", e)
+                        return await self.llm.ainvoke(messages)
+                    finally:
+                        await stream.aclose()
+                    return text
+
+                def _step_prompt_head(self, dialog_text, plan_steps):
+                    """
+                    执行步骤提示的公共开头：对话历史和计划步骤列表
+
+                    不含推理过程（推理在计划块之后生成），计划块一结束即可确定，
+                    提前生成的步骤行动与执行阶段使用完全相同的提示。
+                    """
+                    return "".join([
+                        "对话历史:\n", dialog_text,
+                        "\n执行历史:\n生成的计划:\n执行步骤列表: ", ", ".join(plan_steps), "\n"
+                    ])
 
-                            # 添加更详细的日志，便于调试
-                            self.logger.info(f"[Planning-then-Execution模式] 步骤 {step_num} 工具执行结果: {tool_result[:100]}...")
-
-                            # 检查是否为工具调用失败的情况
-                            if "错误" in tool_result or "失败" in tool_result or "未知" in tool_result:
-                                self.logger.warning(f"[Planning-then-Execution模式] 步骤 {step_num} 工具调用可能失败: {tool_result}")
-                        
-                        # 检查是否达到最大步骤限制
-                        if step_num >= self.config.max_steps:
-                            self.logger.warning(f"[Planning-then-Execution模式] 达到最大执行步骤限制: {self.config.max_steps}")
-                            break
+                def _prefetch_plan_steps(self, plan_text, dialog_text):
+                    """
+                    计划块结束后，按执行阶段的提示在后台提前为第一批执行的步骤生成执行行动
+
+                    第一批步骤由完整计划块中各步骤行的依赖标注确定（与执行阶段的分批方式相同），
+                    不会根据尚未生成的步骤行提前判断。
+                    """
+                    plan_steps, _, plan_dependencies = parse_plan_with_reasoning(plan_text)
+                    plan_steps = plan_steps[:self.config.max_steps]
+                    if not plan_steps:
+                        return
+                    prompt_head = self._step_prompt_head(dialog_text, plan_steps)
+                    for step_num in group_steps_into_waves(len(plan_steps), plan_dependencies)[0]:
+                        self._prefetch_step(step_num, plan_steps[step_num - 1], prompt_head)
+
+                def _prefetch_step(self, step_num, step_description, prompt_prefix):
+                    """在后台提前为第一批执行的步骤生成执行行动（此时执行历史中还没有步骤结果）"""
+                    execution_prompt = self._build_step_prompt(prompt_prefix, step_num, step_description)
+                    task = asyncio.create_task(self._generate_step_response([
+                        {"role": "system", "content": planning_execution_prompt},
+                        {"role": "user", "content": execution_prompt}
+                    ]))
+                    # 任务可能最终不被使用，提前取走异常避免"exception was never retrieved"警告
+                    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                    self.execution_state.prefetched_steps[step_num] = (execution_prompt, task)
+
+                async def _execution_phase(self, user_input, dialog_text, execution_history, plan_steps, plan_dependencies=None):
+                    """Execution阶段：按依赖关系分批执行计划并生成最终结果"""
+                    self.logger.info("[Planning-then-Execution模式] 开始Execution阶段，共%s个步骤", len(plan_steps))
+
+                    # 检查是否超过最大步骤限制
+                    if len(plan_steps) > self.config.max_steps:
+                        self.logger.warning("[Planning-then-Execution模式] 达到最大执行步骤限制: %s", self.config.max_steps)
+                        plan_steps = plan_steps[:self.config.max_steps]
+
+                    # 按步骤数预分配结果列表
+                    self.execution_state.results = [None] * len(plan_steps)
+
+                    # 提示词公共部分（对话历史 + 执行历史）只追加增量，避免每个步骤重新拼接完整历史；
+                    # 最终总结使用完整的执行历史
+                    prompt_buf = ["对话历史:\n", dialog_text, "\n执行历史:\n"]
+                    prompt_buf.extend(f"{entry}\n" for entry in execution_history)
+
+                    # 执行步骤的提示以对话历史和计划步骤列表开头，之后只保留最近若干条执行历史原文，
+                    # 更早的条目折叠为截断后的预览，单步提示长度不再随步骤数线性增长（窗口大小不大于0时保留全部原文）
+                    step_prompt_head = self._step_prompt_head(dialog_text, plan_steps)
+                    window = settings.agent_step_history_window
+                    recent_history = deque(maxlen=window if window > 0 else None)
+                    folded_history = []
+                    preview_chars = settings.agent_step_history_preview_chars
+
+                    # 按依赖关系分批执行计划步骤，同一批次内的步骤互不依赖，并发执行
+                    for wave in group_steps_into_waves(len(plan_steps), plan_dependencies):
+                        if len(wave) > 1:
+                            self.logger.info("[Planning-then-Execution模式] 并发执行互不依赖的步骤: %s", wave)
+                        prompt_prefix = "".join([step_prompt_head, *folded_history, *recent_history])
+                        wave_histories = await asyncio.gather(*[
+                            self._run_step(
+                                step_num,
+                                plan_steps[step_num - 1],
+                                prompt_prefix,
+                                len(plan_steps)
+                            )
+                            for step_num in wave
+                        ])
+                        # 按步骤顺序合并执行历史
+                        for step_history in wave_histories:
+                            execution_history.extend(step_history)
+                            for entry in step_history:
+                                rendered = f"{entry}\n"
+                                prompt_buf.append(rendered)
+                                if len(recent_history) == recent_history.maxlen:
+                                    evicted = recent_history[0]
+                                    if len(evicted) > preview_chars:
+                                        evicted = f"{evicted[:preview_chars]}...(已截断)\n"
+                                    folded_history.append(evicted)
+                                recent_history.append(rendered)
                     
+                    # 所有步骤都是直接回答（未调用任何工具）时，无需再调用大模型总结，按步骤顺序合并各步的回答
+                    results = self.execution_state.results
+                    if (plan_steps and not self.execution_state.tool_used
+                            and all(result is not None for result in results)):
+                        final_answer = "\n\n".join(
+                            answer for answer in (str(result).strip() for result in results) if answer
+                        )
+                        if final_answer:
+                            self.logger.info("[Planning-then-Execution模式] 所有步骤均为直接回答，跳过最终总结")
+                            self.execution_state.status = "completed"
+                            self.execution_state.final_answer = final_answer
+                            return final_answer
+
                     # 生成最终总结
                     self.logger.info("[Planning-then-Execution模式] 执行完所有计划步骤，生成最终总结")
                     
-                    # 构建总结提示
-                    summary_prompt = planning_execution_prompt
-                    summary_prompt += "\n\n对话历史:\n"
-                    for msg in dialog_history:
-                        summary_prompt += f"{msg['role']}: {msg['content']}\n"
-                    
-                    summary_prompt += "\n执行历史:\n"
-                    for entry in execution_history:
-                        summary_prompt += f"{entry}\n"
+                    # 相同请求、计划和执行结果的最终答案直接复用
+                    if settings.agent_plan_cache_enabled:
+                        cached_answer = plan_cache.get_answer(
+                            user_input, plan_steps, execution_history, self.execution_state.history_digest
+                        )
+                        if cached_answer is not None:
+                            self.execution_state.status = "completed"
+                            self.execution_state.final_answer = cached_answer
+                            return cached_answer
                     
-                    summary_prompt += "\n现在所有计划步骤已执行完毕，请提供最终答案。使用Final Answer: [最终答案]格式。"
+                    # 构建总结提示
+                    prompt_buf.append("\n现在所有计划步骤已执行完毕，请提供最终答案。使用Final Answer: [最终答案]格式。")
+                    summary_prompt = "".join(prompt_buf)
                     
-                    # 生成最终总结
-                    summary_response = await self.llm.ainvoke([
-                        {"role": "system", "content": summary_prompt}
-                    ])
+                    # 生成最终总结：开启流式输出时将最终答案逐段作为token事件发送，降低首字延迟
+                    summary_messages = [
+                        {"role": "system", "content": planning_execution_prompt},
+                        {"role": "user", "content": summary_prompt}
+                    ]
+                    if self._evt_queue is not None:
+                        summary_response = await self._stream_summary(summary_messages)
+                    else:
+                        summary_response = await self.llm.ainvoke(summary_messages)
                     
                     # 尝试提取最终答案
-                    final_answer = self._extract_final_answer(summary_response)
+                    final_answer = extract_final_answer(summary_response)
+                    
+                    if settings.agent_plan_cache_enabled:
+                        plan_cache.put_answer(
+                            user_input, plan_steps, execution_history, final_answer, self.execution_state.history_digest
+                        )
                     
                     # 更新执行状态为完成
-                    self.execution_state["status"] = "completed"
-                    self.execution_state["final_answer"] = final_answer
+                    self.execution_state.status = "completed"
+                    self.execution_state.final_answer = final_answer
                     
                     return final_answer
                     
-                def _extract_final_answer(self, response):
-                    """提取最终答案并过滤内部标记"""
-                    import re
+                async def _direct_answer(self, dialog_text):
+                    """
+                    单次大模型调用直接生成最终答案（没有可用工具时使用）
+
+                    开启流式输出时逐段转发生成内容。
+
+                    Returns:
+                        str: 最终答案
+                    """
+                    messages = [
+                        {"role": "system", "content": planning_execution_prompt},
+                        {"role": "user", "content": "".join([
+                            "对话历史:\n",
+                            dialog_text,
+                            "\n当前没有可用的工具，请直接回答用户的问题。使用Final Answer: [最终答案]格式。"
+                        ])}
+                    ]
+                    if self._evt_queue is not None:
+                        response = await self._stream_summary(messages)
+                    else:
+                        response = await self.llm.ainvoke(messages)
+                    final_answer = extract_final_answer(response)
+                    self.execution_state.status = "completed"
+                    self.execution_state.final_answer = final_answer
+                    return final_answer
 
-                    try:
-                        final_answer = response
-
-                        # 步骤1: 尝试提取 Final Answer: 后面的内容
-                        if "Final Answer:" in response:
-                            answer_start = response.index("Final Answer:") + len("Final Answer:")
-                            final_answer = response[answer_start:].strip()
-                        elif "Execution Complete:" in response:
-                            # 从执行完成后查找可能的答案
-                            complete_start = response.index("Execution Complete:")
-                            potential_answer = response[complete_start + len("Execution Complete:"):].strip()
-                            # 如果还包含Final Answer，再次提取
-                            if "Final Answer:" in potential_answer:
-                                return self._extract_final_answer(potential_answer)
-                            final_answer = potential_answer
-                        elif "Finish[" in response and "]" in response:
-                            # 兼容旧格式
-                            finish_start = response.index("Finish[") + 7
-                            finish_end = response.rfind("]")
-                            if finish_start < finish_end:
-                                final_answer = response[finish_start:finish_end].strip()
-
-                        # 步骤2: 过滤掉所有内部过程标记
-                        # 移除 Plan: 段落
-                        final_answer = re.sub(r'Plan:\s*\n(.*?)\n\n', '', final_answer, flags=re.DOTALL)
-                        final_answer = re.sub(r'Plan:.*?(?=\n\n|\Z)', '', final_answer, flags=re.DOTALL)
-
-                        # 移除 Reasoning: 段落
-                        final_answer = re.sub(r'Reasoning:\s*\n(.*?)\n\n', '', final_answer, flags=re.DOTALL)
-                        final_answer = re.sub(r'Reasoning:.*?(?=\n\n|\Z)', '', final_answer, flags=re.DOTALL)
-
-                        # 移除 Step: ... Action: ... Result: ... 这样的执行过程（增强版）
-                        # 移除以 Step: 开头的整行
-                        final_answer = re.sub(r'^Step:\s*.*$', '', final_answer, flags=re.MULTILINE)
-                        final_answer = re.sub(r'\nStep:\s*.*$', '', final_answer, flags=re.MULTILINE)
-
-                        # 移除以 Action: 开头的整行
-                        final_answer = re.sub(r'^Action:\s*.*$', '', final_answer, flags=re.MULTILINE)
-                        final_answer = re.sub(r'\nAction:\s*.*$', '', final_answer, flags=re.MULTILINE)
-
-                        # 移除以 Result: 开头的整行
-                        final_answer = re.sub(r'^Result:\s*.*$', '', final_answer, flags=re.MULTILINE)
-                        final_answer = re.sub(r'\nResult:\s*.*$', '', final_answer, flags=re.MULTILINE)
-
-                        # 移除 Execution Complete: 标记本身
-                        final_answer = re.sub(r'Execution Complete:.*?\n', '', final_answer)
-                        final_answer = re.sub(r'^Execution Complete:\s*.*$', '', final_answer, flags=re.MULTILINE)
-
-                        # 移除 Final Answer: 标记本身（如果还有残留）
-                        final_answer = re.sub(r'^Final Answer:\s*', '', final_answer)
-                        final_answer = re.sub(r'\nFinal Answer:\s*', '\n', final_answer)
-
-                        # 步骤3: 清理多余的空白
-                        final_answer = final_answer.strip()
-
-                        # 步骤4: 如果过滤后内容为空，返回一个友好的默认消息
-                        if not final_answer:
-                            self.logger.warning("[Planning-then-Execution模式] 过滤后内容为空")
-                            return "处理完成"
-
-                        return final_answer
+                async def _stream_summary(self, messages):
+                    """
+                    流式生成最终总结，返回完整文本
 
-                    except Exception as e:
-                        self.logger.error(f"[Planning-then-Execution模式] 提取最终答案失败: {str(e)}")
-                        # 发生错误时，尝试至少返回一些内容
-                        return response.split("Final Answer:")[-1].strip() if "Final Answer:" in response else response
-                    
-                def _parse_plan_with_reasoning(self, response):
-                    """解析LLM生成的计划，提取步骤列表和推理过程"""
+                    只有 Final Answer: 之后、<video_info>块以外的答案文字作为token事件发送，
+                    完整答案和视频信息仍由完成事件返回。流式调用在输出任何内容前失败时退回普通调用。
+                    """
+                    chunks = []
+                    answer_stream = FinalAnswerStream()
                     try:
-                        plan_steps = []
-                        reasoning = "无详细推理"
-                        
-                        # 提取推理过程
-                        if "Reasoning:" in response:
-                            reason_start = response.index("Reasoning:") + len("Reasoning:")
-                            # 找到下一个可能的部分开始位置
-                            next_section_start = min(
-                                response.find("Plan:", reason_start) if "Plan:" in response[reason_start:] else len(response),
-                                response.find("Step:", reason_start) if "Step:" in response[reason_start:] else len(response),
-                                response.find("Execution:", reason_start) if "Execution:" in response[reason_start:] else len(response)
-                            )
-                            reasoning = response[reason_start:next_section_start].strip()
-                        
-                        # 提取计划步骤
-                        if "Plan:" in response:
-                            plan_section = response[response.index("Plan:"):]
-                            
-                            # 提取每个步骤
-                            for line in plan_section.split("\n"):
-                                line = line.strip()
-                                if line.startswith("1.") or line.startswith("2.") or line.startswith("3.") or \
-                                   line.startswith("4.") or line.startswith("5."):
-                                    # 提取步骤编号和描述，移除可能的工具信息
-                                    if "." in line:
-                                        step_parts = line.split(".", 1)[1].strip()
-                                        # 如果包含"-"，移除后面的预期工具部分
-                                        if "-" in step_parts and not step_parts.startswith("-"):
-                                            step_desc = step_parts.split("-", 1)[0].strip()
-                                        else:
-                                            step_desc = step_parts
-                                        if step_desc:
-                                            plan_steps.append(step_desc)
-                        return plan_steps, reasoning
+                        async for delta in self.llm.astream(messages):
+                            chunks.append(delta)
+                            text = answer_stream.feed(delta)
+                            if text:
+                                self._emit({
+                                    "type": "token",
+                                    "delta": text
+                                })
                     except Exception as e:
-                        self.logger.error(f"[Planning-then-Execution模式] 解析计划失败: {str(e)}")
-                        return [], "解析计划时出错"
+                        if chunks:
+                            raise
+                        self.logger.warning("[Planning-then-Execution模式] 流式生成总结失败，改用普通调用: %s", e)
+                        return await self.llm.ainvoke(messages)
+                    return "".join(chunks)
+
+                def _build_step_prompt(self, prompt_prefix, step_num, step_description):
+                    """在对话历史和执行历史之后追加当前步骤信息，构建执行步骤的提示"""
+                    return "".join([
+                        prompt_prefix,
+                        # 提醒模型复用执行历史中已有的工具结果，避免重复调用
+                        "\n注意：执行历史中已经记录了之前的工具调用及其结果。如果所需信息已经存在，请直接使用，不要用相同的参数重复调用同一个工具。\n",
+                        f"\n当前执行阶段 - 需要执行的步骤:\n{step_num}. {step_description}"
+                    ])
+
+                async def _run_step(self, step_num, step_description, prompt_prefix, total_steps):
+                    """
+                    执行单个计划步骤
+
+                    Args:
+                        step_num: 步骤编号
+                        step_description: 步骤描述
+                        prompt_prefix: 已渲染好的对话历史和执行历史
+                        total_steps: 步骤总数
+
+                    Returns:
+                        list: 本步骤产生的执行历史条目
+                    """
+                    self.current_step = step_num
+                    self.logger.info("[Planning-then-Execution模式] 执行步骤 %s/%s: %s", step_num, total_steps, step_description)
+
+                    # 发送步骤开始事件
+                    self._emit({
+                        "type": "step_start",
+                        "step_number": step_num,
+                        "step_description": step_description,
+                        "total_steps": total_steps
+                    })
                     
-                def _parse_execution_step(self, response):
-                    """解析执行阶段的步骤响应"""
-                    try:
-                        step_info = None
-                        action = None
-                        
-                        # 提取Step部分
-                        if "Step:" in response:
-                            step_start = response.index("Step:") + 5
-                            # 找到Action部分的开始位置
-                            action_start_pos = response.find("Action:", step_start)
-                            if action_start_pos != -1:
-                                step_info = response[step_start:action_start_pos].strip()
-                            else:
-                                step_info = response[step_start:].strip()
+                    # 构建执行步骤的提示
+                    execution_prompt = self._build_step_prompt(prompt_prefix, step_num, step_description)
+                    
+                    # 调用LLM生成当前步骤的行动；规划阶段已用相同提示提前发起的生成直接复用
+                    prefetched = self.execution_state.prefetched_steps.pop(step_num, None)
+                    if prefetched is not None and prefetched[0] == execution_prompt:
+                        self.logger.info("[Planning-then-Execution模式] 复用规划阶段提前生成的步骤 %s 行动", step_num)
+                        step_response = await prefetched[1]
+                    else:
+                        if prefetched is not None:
+                            # 提示不一致（如计划变化）时，提前生成的结果不可用
+                            prefetched[1].cancel()
+                        self.logger.info("[Planning-then-Execution模式] 为步骤 %s 生成执行行动", step_num)
+                        step_response = await self._generate_step_response([
+                            {"role": "system", "content": planning_execution_prompt},
+                            {"role": "user", "content": execution_prompt}
+                        ])
+                    
+                    # 解析步骤响应（同一步骤可能包含多个互不依赖的工具调用）
+                    step_info, actions = parse_execution_actions(step_response)
+                    
+                    if not actions:
+                        self.logger.error("[Planning-then-Execution模式] 无法解析步骤 %s 的响应格式", step_num)
+                        # 生成更明确的提示，引导使用工具
+                        recovery_prompt = "".join([
+                            execution_prompt,
+                            "\n\n警告：之前的输出格式不正确。请按照指定格式输出，特别是对于需要获取外部信息的任务，请使用工具调用格式。\n",
+                            f"可用工具: {list(self._tool_names)}\n"
+                        ])
                         
-                        # 提取Action部分
-                        if "Action:" in response:
-                            action_start = response.index("Action:") + 7
-                            # 找到Result部分的开始位置或文本结束
-                            result_start_pos = response.find("Result:", action_start)
-                            if result_start_pos != -1:
-                                action = response[action_start:result_start_pos].strip()
-                            else:
-                                action = response[action_start:].strip()
+                        # 重新获取响应
+                        self.logger.info("[Planning-then-Execution模式] 尝试恢复步骤 %s 的执行", step_num)
+                        step_response = await self._generate_step_response([
+                            {"role": "system", "content": planning_execution_prompt},
+                            {"role": "user", "content": recovery_prompt}
+                        ])
+                        # 再次尝试解析
+                        step_info, actions = parse_execution_actions(step_response)
                         
-                        return step_info, action
-                    except Exception as e:
-                        self.logger.error(f"[Planning-then-Execution模式] 解析步骤响应失败: {str(e)}")
-                        return None, None
+                        if not actions:
+                            self.logger.error("[Planning-then-Execution模式] 恢复失败，跳过步骤 %s", step_num)
+                            return []
                     
-
+                    # 本步骤产生的执行历史，由调用方在批次完成后按步骤顺序合并
+                    step_history = [f"Step: {step_info}"]
                     
+                    # 检查是否为直接回答
+                    action = actions[0]
+                    if action.startswith("Direct[") and action.endswith("]"):
+                        # 提取直接回答
+                        direct_answer = action[7:-1].strip()
+                        step_history.append(f"Action: {action}")
+                        step_history.append(f"Result: {direct_answer}")
+                        self.execution_state.results[step_num - 1] = direct_answer
+                        self.logger.info("[Planning-then-Execution模式] 步骤 %s 直接回答: %s", step_num, direct_answer)
+
+                        # 发送步骤完成事件（不包含执行细节）
+                        self._emit({
+                            "type": "step_complete",
+                            "step_number": step_num
+                        })
+
+                        # 添加直接回答的原因记录，便于调试
+                        self.logger.info("[Planning-then-Execution模式] 步骤 %s 使用直接回答，跳过工具调用", step_num)
+                    else:
+                        for i, action in enumerate(actions):
+                            # 验证是否为有效的工具调用格式
+                            if "(" not in action or ")" not in action:
+                                self.logger.warning("[Planning-then-Execution模式] 步骤 %s 工具调用格式可能不正确: %s", step_num, action)
+                                # 尝试规范化工具调用格式
+                                tool_name_candidate = action.strip()
+                                if tool_name_candidate in self._tool_name_set:
+                                    self.logger.info("[Planning-then-Execution模式] 规范化工具调用格式")
+                                    actions[i] = f"{tool_name_candidate}()"
+
+                        # 并发调用本步骤的所有工具，总并发数由 tool_semaphore 限制
+                        if len(actions) > 1:
+                            self.logger.info("[Planning-then-Execution模式] 步骤 %s 并发调用 %s 个工具: %s", step_num, len(actions), actions)
+                        else:
+                            self.logger.info("[Planning-then-Execution模式] 准备调用工具: %s", actions[0])
+                        self.execution_state.tool_used = True
+                        tool_results = await asyncio.gather(
+                            *(self._execute_tool(action) for action in actions),
+                            return_exceptions=True
+                        )
+
+                        step_results = []
+                        for action, tool_result in zip(actions, tool_results):
+                            if isinstance(tool_result, BaseException):
+                                tool_result = f"工具执行失败: {str(tool_result)}"
+                            step_history.append(f"Action: {action}")
+                            step_history.append(f"Result: {tool_result}")
+                            step_results.append(tool_result)
+
+                            # 添加更详细的日志，便于调试
+                            self.logger.info("[Planning-then-Execution模式] 步骤 %s 工具执行结果: %.100s...", step_num, tool_result)
+
+                            # 检查是否为工具调用失败的情况
+                            if "错误" in tool_result or "失败" in tool_result or "未知" in tool_result:
+                                self.logger.warning("[Planning-then-Execution模式] 步骤 %s 工具调用可能失败: %s", step_num, tool_result)
+
+                        self.execution_state.results[step_num - 1] = "\n".join(step_results)
+
+                        # 发送步骤完成事件（不包含执行细节）
+                        self._emit({
+                            "type": "step_complete",
+                            "step_number": step_num
+                        })
+
+                    return step_history
+
                 async def _execute_tool(self, action_str):
                     """执行工具调用 - 增强版"""
                     try:
                         # 增强的工具调用格式解析
                         # 格式: tool_name(param1=value1, param2=value2)
                         if "(" in action_str and ")" in action_str:
-                            # 提取工具名称
-                            tool_name_end = action_str.find("(")
-                            if tool_name_end == -1:
+                            # 一次正则匹配拆出工具名称和参数部分（忽略右括号之后的多余文本）
+                            tool_call = split_tool_call(action_str)
+                            if tool_call is None:
                                 return "工具调用格式错误"
-                            
-                            tool_name = action_str[:tool_name_end].strip()
+                            tool_name, params_str = tool_call
                             
                             # 检查工具是否存在
-                            if tool_name not in self.tool_map:
+                            if tool_name not in self._tool_name_set:
                                 return f"未知工具: {tool_name}"
                             
-                            # 提取参数部分
-                            params_str = action_str[tool_name_end+1:-1].strip()
-                            
                             # 解析参数 - 增强版，支持更复杂的参数格式
-                            params = self._parse_complex_params(params_str)
+                            params = parse_tool_params(params_str)
 
-                            # 如果是 search_video_by_vector 工具且没有 user_id 参数，自动注入
-                            if tool_name == "search_video_by_vector" and "user_id" not in params:
-                                extracted_user_id = self.execution_state.get("user_id")
+                            # search_video_by_vector 的 user_id 一律以当前请求的用户为准，不信任计划或模型给出的值；
+                            # 请求中没有用户ID时去掉该参数，由工具使用路由设置的当前用户
+                            if tool_name == "search_video_by_vector":
+                                extracted_user_id = self.execution_state.user_id
                                 if extracted_user_id:
                                     params["user_id"] = extracted_user_id
-                                    self.logger.info(f"[Planning-工具调用] 自动注入 user_id: {extracted_user_id}")
+                                    self.logger.info("[Planning-工具调用] 使用当前用户 user_id: %s", extracted_user_id)
+                                else:
+                                    params.pop("user_id", None)
 
                             # 记录执行状态
-                            self.execution_state["current_tool"] = tool_name
-                            self.execution_state["current_params"] = params
-
-                            # 创建工具调用
-                            tool_call = ToolCall(
-                                tool_name=tool_name,
-                                parameters=params
-                            )
-                            
-                            # 调用工具
-                            self.logger.info(f"[Planning-then-Execution模式] 调用工具: {tool_name}, 参数: {params}")
-                            self.logger.info(f"[MCP工具调用] 开始调用MCP工具: {tool_name}")
+                            self.execution_state.current_tool = tool_name
+                            self.execution_state.current_params = params
+
+                            # 同一会话内相同工具和参数的调用直接复用之前的结果
+                            tool_cache = self.execution_state.tool_cache
+                            cache_key = (tool_name, tuple(sorted((k, str(v)) for k, v in params.items())))
+                            if cache_key in tool_cache:
+                                self.logger.info("[MCP工具调用] 复用本次会话中的工具结果: %s", tool_name)
+                                return tool_cache[cache_key]
+
+                            # 调用工具（直接传递工具名和参数，无需构造ToolCall对象）
+                            self.logger.info("[Planning-then-Execution模式] 调用工具: %s, 参数: %s", tool_name, params)
+                            self.logger.info("[MCP工具调用] 开始调用MCP工具: %s", tool_name)
                             
-                            # 执行工具调用，添加超时处理
+                            # 执行工具调用，添加超时处理；并发调用数受 tool_semaphore 限制
                             try:
-                                self.logger.info(f"[MCP工具调用] 向MCP服务器发送工具调用请求")
-                                result = await asyncio.wait_for(
-                                    mcp_server.call_tool_async(
-                                        tool_name=tool_call.tool_name,
-                                        parameters=tool_call.parameters
-                                    ), 
-                                    timeout=30.0  # 设置30秒超时
-                                )
+                                async with self.execution_state.tool_semaphore:
+                                    self.logger.info("[MCP工具调用] 向MCP服务器发送工具调用请求")
+                                    result = await asyncio.wait_for(
+                                        mcp_server.call_tool_async(
+                                            tool_name=tool_name,
+                                            parameters=params
+                                        ),
+                                        timeout=settings.agent_tool_call_timeout
+                                    )
                             
                                 # 验证结果
                                 if result and hasattr(result, 'result'):
-                                    self.logger.info(f"[MCP工具调用] 工具调用成功完成: {tool_name}")
-                                    self.logger.info(f"[MCP工具调用] 工具返回结果: {result.result}")
-                                    return result.result
+                                    self.logger.info("[MCP工具调用] 工具调用成功完成: %s", tool_name)
+                                    # 工具结果可能是很大的JSON，只在调试级别输出
+                                    if self.logger.isEnabledFor(logging.DEBUG):
+                                        self.logger.debug("[MCP工具调用] 工具返回结果: %s", result.result)
+                                    if not result.success:
+                                        return f"工具调用失败: {result.error}"
+                                    tool_result = _serialize_tool_result(result.result)
+                                    tool_cache[cache_key] = tool_result
+                                    return tool_result
                                 else:
-                                    self.logger.warning(f"[MCP工具调用] 工具返回格式异常: {tool_name}")
+                                    self.logger.warning("[MCP工具调用] 工具返回格式异常: %s", tool_name)
                                     return "工具返回格式异常"
                             except asyncio.TimeoutError:
-                                self.logger.warning(f"[MCP工具调用] 工具调用超时: {tool_name}")
+                                self.logger.warning("[MCP工具调用] 工具调用超时: %s", tool_name)
                                 return f"工具调用超时: {tool_name}"
                         else:
                             return "工具调用格式错误"
                     except Exception as e:
-                        self.logger.error(f"[Planning-then-Execution模式] 执行工具失败: {str(e)}")
+                        self.logger.error("[Planning-then-Execution模式] 执行工具失败: %s", e)
                         return f"工具执行失败: {str(e)}"
-                    
-                def _parse_complex_params(self, params_str):
-                    """增强的参数解析器，支持更复杂的参数格式"""
-                    params = {}
-                    if not params_str.strip():
-                        return params
-                    
-                    try:
-                        # 处理嵌套的引号和逗号
-                        # 基本思路：跟踪括号和引号状态，正确分割参数
-                        in_quotes = False
-                        quote_char = None
-                        current_param = ""
-                        param_pairs = []
-                        
-                        for char in params_str + ",":  # 添加额外逗号以处理最后一个参数
-                            if char in ["'", '"'] and (not in_quotes or char == quote_char):
-                                in_quotes = not in_quotes
-                                if in_quotes:
-                                    quote_char = char
-                                else:
-                                    quote_char = None
-                                current_param += char
-                            elif char == "," and not in_quotes:
-                                if current_param.strip():
-                                    param_pairs.append(current_param.strip())
-                                current_param = ""
-                            else:
-                                current_param += char
-                        
-                        # 处理每个参数对
-                        for param_pair in param_pairs:
-                            if "=" in param_pair:
-                                key, value = param_pair.split("=", 1)
-                                key = key.strip()
-                                # 移除可能的引号
-                                value = value.strip()
-                                if (value.startswith("'") and value.endswith("'") or 
-                                    value.startswith('"') and value.endswith('"')):
-                                    value = value[1:-1]
-                                params[key] = value
-                    except Exception as e:
-                        self.logger.error(f"[Planning-then-Execution模式] 解析参数失败: {str(e)}")
-                        # 回退到简单解析
-                        for param_pair in params_str.split(","):
-                            if "=" in param_pair:
-                                key, value = param_pair.split("=", 1)
-                                key = key.strip()
-                                value = value.strip(' "\'')
-                                params[key] = value.strip(' "\'')
-                    
-                    return params
             
             # 创建并返回Planning-then-Execution执行器
             return PlanningThenExecutionExecutor(self.config, langchain_tools, tool_map, llm)
             
         except Exception as e:
-            self.logger.error(f"[Planning-then-Execution模式] 创建Planning-then-Execution执行器失败: {str(e)}")
+            self.logger.error("[Planning-then-Execution模式] 创建Planning-then-Execution执行器失败: %s", e)
             
             # 创建一个增强的Fallback Planning-then-Execution执行器
             class FallbackPlanningThenExecutionExecutor:
                 def __init__(self, config):
                     self.config = config
-                    self.llm_service = VolcLLMService()
-                    self.logger = logging.getLogger(f"FallbackPlanningThenExecutionExecutor")
+                    self.llm_service = llm_service
+                    self.logger = _FALLBACK_EXECUTOR_LOGGER
                     # 获取可用工具信息
                     try:
                         self.tools_info = get_available_tools_info()
                         self.logger.info("[Fallback-工具信息] 已获取可用工具")
                     except Exception as e:
-                        self.logger.warning(f"[Fallback-工具信息] 获取工具失败: {str(e)}")
+                        self.logger.warning("[Fallback-工具信息] 获取工具失败: %s", e)
                         self.tools_info = "目前没有可用工具"
-                
+                    # 使用外部Agent类的统一系统提示词，配置和工具信息不变，只渲染一次
+                    self.system_prompt = Agent.SYSTEM_PROMPT_TEMPLATE.format(
+                        agent_name=self.config.name,
+                        agent_role=self.config.role,
+                        tools_info=self.tools_info
+                    )
+                    # 工具名元组缓存，工具注册表版本变化时才重新构建
+                    self._tool_names = ()
+                    self._tool_names_version = -1
+
+                def _get_tool_names(self):
+                    """获取所有可用MCP工具的名称元组，工具注册表未变化时直接复用"""
+                    tools_version = mcp_server.tools_version
+                    if tools_version != self._tool_names_version:
+                        try:
+                            self._tool_names = tuple(
+                                tool.name for tool in mcp_server.get_available_tools()
+                                if getattr(tool, 'name', None)
+                            )
+                            self._tool_names_version = tools_version
+                            self.logger.info(f"[Fallback-工具] 已加载 {len(self._tool_names)} 个工具")
+                        except Exception as e:
+                            self.logger.warning(f"[Fallback-工具] 获取工具失败: {str(e)}")
+                            self._tool_names = ()
+                    return self._tool_names
+
+                async def _run_step(self, step_num, step_description, prompt_prefix, total_steps,
+                                    tool_names, extracted_user_id, stream_callback):
+                    """
+                    执行单个计划步骤
+
+                    Args:
+                        step_num: 步骤编号
+                        step_description: 步骤描述
+                        prompt_prefix: 已渲染好的对话历史和执行历史
+                        total_steps: 步骤总数
+                        tool_names: 可用工具名元组
+                        extracted_user_id: 从请求中提取的用户ID
+                        stream_callback: 流式事件回调
+
+                    Returns:
+                        list: 本步骤产生的执行历史条目
+                    """
+                    entries = []
+                    self.logger.info("[Fallback-执行] 执行步骤 %s: %s", step_num, step_description)
+
+                    # 发送步骤开始事件
+                    if stream_callback:
+                        self.logger.info("[Fallback] 发送 step_start 事件: 步骤%s", step_num)
+                        await stream_callback({
+                            "type": "step_start",
+                            "step_number": step_num,
+                            "step_description": step_description,
+                            "total_steps": total_steps
+                        })
+
+                    execution_prompt = "".join([
+                        prompt_prefix,
+                        f"\n当前执行步骤:\n{step_num}. {step_description}\n",
+                        "\n请提供执行结果或工具调用。如果需要调用工具，请使用以下格式：工具名称(参数名=参数值, ...)"
+                    ])
+
+                    # 调用LLM生成执行行动，系统提示词作为独立的system消息放在最前，各次调用前缀保持一致
+                    step_response = await self.llm_service.generate_async(
+                        prompt=execution_prompt,
+                        system_prompt=self.system_prompt,
+                        temperature=0.5
+                    )
+
+                    # 检查是否包含工具调用
+                    tool_hit = _find_tool_mention(step_response, tool_names)
+                    if tool_hit:
+                        tool_name, name_end = tool_hit
+                        self.logger.info("[Fallback-工具调用] 尝试调用工具: %s", tool_name)
+                        # 简单提取参数并调用工具
+                        try:
+                            # 简单的参数提取逻辑
+                            if step_response.startswith("(", name_end):
+                                # 按位置切出括号内的参数，不生成中间列表
+                                params_start = name_end + 1
+                                params_end = step_response.find(")", params_start)
+                                if params_end == -1:
+                                    params_end = len(step_response)
+                                call_str = step_response[params_start:params_end]
+                                params = parse_tool_params(call_str)
+
+                                # search_video_by_vector 的 user_id 一律以当前请求的用户为准，不信任模型给出的值；
+                                # 请求中没有用户ID时去掉该参数，由工具使用路由设置的当前用户
+                                if tool_name == "search_video_by_vector":
+                                    if extracted_user_id:
+                                        params["user_id"] = extracted_user_id
+                                        self.logger.info("[Fallback-工具调用] 使用当前用户 user_id: %s", extracted_user_id)
+                                    else:
+                                        params.pop("user_id", None)
+
+                                # 调用MCP工具，修复参数格式
+                                tool_response = await mcp_server.call_tool_async(
+                                    tool_name=tool_name,
+                                    parameters=params
+                                )
+                                if tool_response.success:
+                                    tool_result = _serialize_tool_result(tool_response.result)
+                                    self.logger.info("[Fallback-工具调用] 工具 %s 调用成功", tool_name)
+                                else:
+                                    tool_result = f"工具调用失败: {tool_response.error}"
+                                    self.logger.error("[Fallback-工具调用] 工具 %s 调用失败: %s", tool_name, tool_response.error)
+
+                                entries.append(f"Step {step_num}: {step_description}")
+                                entries.append(f"Action: {tool_name}({call_str})")
+                                entries.append(f"Result: {tool_result}")
+
+                                # 发送步骤完成事件（不包含执行细节）
+                                if stream_callback:
+                                    self.logger.info("[Fallback] 发送 step_complete 事件: 步骤%s", step_num)
+                                    await stream_callback({
+                                        "type": "step_complete",
+                                        "step_number": step_num
+                                    })
+                        except Exception as e:
+                            self.logger.error("[Fallback-工具调用] 解析或调用工具 %s 失败: %s", tool_name, e)
+                    else:
+                        # 直接回答
+                        entries.append(f"Step {step_num}: {step_description}")
+                        entries.append(f"Result: {step_response.strip()}")
+
+                        # 发送步骤完成事件（不包含执行细节）
+                        if stream_callback:
+                            self.logger.info("[Fallback] 发送 step_complete 事件: 步骤%s (直接回答)", step_num)
+                            await stream_callback({
+                                "type": "step_complete",
+                                "step_number": step_num
+                            })
+
+                    return entries
+
                 async def ainvoke(self, inputs):
                     user_input = inputs.get("input", "")
                     dialog_history = inputs.get("chat_history", [])
                     stream_callback = inputs.get("stream_callback", None)  # 获取流式回调
                     execution_history = []
 
-                    self.logger.info(f"[Fallback ainvoke] 被调用, user_input={user_input[:50]}...")
-                    self.logger.info(f"[Fallback ainvoke] stream_callback 是否存在: {stream_callback is not None}")
+                    self.logger.info("[Fallback ainvoke] 被调用, user_input=%.50s...", user_input)
+                    self.logger.info("[Fallback ainvoke] stream_callback 是否存在: %s", stream_callback is not None)
 
                     # 从 user_input 中提取 user_id
-                    import re
-                    user_id_match = re.search(r'当前用户ID:\s*([a-zA-Z0-9_-]+)', user_input)
+                    user_id_match = _USER_ID_RE.search(user_input)
                     extracted_user_id = user_id_match.group(1) if user_id_match else None
                     if extracted_user_id:
-                        self.logger.info(f"[Fallback] 从输入中提取到用户ID: {extracted_user_id}")
+                        self.logger.info("[Fallback] 从输入中提取到用户ID: %s", extracted_user_id)
 
-                    # 使用外部Agent类的统一系统提示词
-                    system_prompt = Agent.SYSTEM_PROMPT_TEMPLATE.format(
-                        agent_name=self.config.name,
-                        agent_role=self.config.role,
-                        tools_info=self.tools_info
-                    )
+                    system_prompt = self.system_prompt
                     
                     try:
-                        # 获取所有可用的MCP工具并创建工具映射
-                        tool_map = {}
-                        try:
-                            mcp_tools = mcp_server.get_available_tools()
-                            for tool in mcp_tools:
-                                tool_name = getattr(tool, 'name', None)
-                                if tool_name:
-                                    tool_map[tool_name] = tool
-                            self.logger.info(f"[Fallback-工具] 已加载 {len(tool_map)} 个工具")
-                        except Exception as e:
-                            self.logger.warning(f"[Fallback-工具] 获取工具失败: {str(e)}")
+                        # 获取所有可用的MCP工具名称，工具名元组同时作为匹配器缓存键，每个步骤只需一次扫描即可找到提到的工具
+                        tool_names = self._get_tool_names()
                         
                         # 发送 Planning 开始事件
                         if stream_callback:
@@ -1024,41 +1853,17 @@ Final Answer: [对用户问题的最终回答]
                             })
 
                         # 调用LLM生成计划
-                        self.logger.info(f"[Planning-then-Execution模式-异常恢复] 调用大模型生成计划")
+                        self.logger.info("[Planning-then-Execution模式-异常恢复] 调用大模型生成计划")
                         response = await self.llm_service.generate_async(
                             prompt=user_input,
                             system_prompt=system_prompt,
                             temperature=0.7
                         )
 
-                        # 解析计划
-                        plan = []
-                        reasoning = "无详细推理"
-
-                        # 提取推理过程
-                        if "Reasoning:" in response:
-                            reason_start = response.index("Reasoning:") + len("Reasoning:")
-                            next_section = response.find("\n\n", reason_start)
-                            if next_section != -1:
-                                reasoning = response[reason_start:next_section].strip()
-                            else:
-                                reasoning = response[reason_start:].strip()
-
-                        if "Plan:" in response:
-                            plan_start = response.index("Plan:") + len("Plan:")
-                            if "Reasoning:" in response:
-                                plan_end = response.index("Reasoning:")
-                            else:
-                                plan_end = len(response)
-                            
-                            plan_text = response[plan_start:plan_end].strip()
-                            for line in plan_text.split('\n'):
-                                if line.strip().startswith(('1.', '2.', '3.', '4.', '5.')):
-                                    # 提取计划步骤，去掉序号
-                                    step_text = line.split('.', 1)[1].strip()
-                                    plan.append(step_text)
-                        
-                        self.logger.info(f"[Fallback-执行] 提取到 {len(plan)} 个计划步骤")
+                        # 解析计划和推理过程：与主执行器共用解析函数，一次正则扫描提取全部编号步骤
+                        plan, reasoning, plan_dependencies = parse_plan_with_reasoning(response)
+
+                        self.logger.info("[Fallback-执行] 提取到 %d 个计划步骤", len(plan))
 
                         # 发送 Planning 完成事件
                         if stream_callback:
@@ -1080,173 +1885,52 @@ Final Answer: [对用户问题的最终回答]
 
                         # 执行计划
                         if plan:
-                            for step_num, step_description in enumerate(plan, 1):
-                                self.logger.info(f"[Fallback-执行] 执行步骤 {step_num}: {step_description}")
+                            # 对话历史在各步骤间不变，只渲染一次；执行历史只追加新增条目
+                            prompt_parts = ["对话历史:\n"]
+                            prompt_parts.extend(f"{msg['role']}: {msg['content']}\n" for msg in dialog_history)
+                            prompt_parts.append("\n执行历史:\n")
+                            rendered_history = 0
+                            # 使用计划中的依赖标注，未标注的步骤依赖上一步；
+                            # 互不依赖的步骤并发执行，执行历史按步骤顺序写入
+                            for wave in group_steps_into_waves(len(plan), plan_dependencies):
+                                if len(wave) > 1:
+                                    self.logger.info("[Fallback-执行] 并发执行互不依赖的步骤: %s", wave)
+                                # 同一批次的步骤共享相同的执行历史前缀，公共前缀只追加上一批新增的条目
+                                prompt_parts.extend(f"{entry}\n" for entry in execution_history[rendered_history:])
+                                rendered_history = len(execution_history)
+                                prompt_prefix = "".join(prompt_parts)
+                                wave_entries = await asyncio.gather(*(
+                                    self._run_step(
+                                        step_num, plan[step_num - 1], prompt_prefix, len(plan),
+                                        tool_names, extracted_user_id, stream_callback
+                                    )
+                                    for step_num in wave
+                                ))
+                                for entries in wave_entries:
+                                    execution_history.extend(entries)
 
-                                # 发送步骤开始事件
-                                if stream_callback:
-                                    self.logger.info(f"[Fallback] 发送 step_start 事件: 步骤{step_num}")
-                                    await stream_callback({
-                                        "type": "step_start",
-                                        "step_number": step_num,
-                                        "step_description": step_description,
-                                        "total_steps": len(plan)
-                                    })
-
-                                # 构建执行步骤的提示
-                                execution_prompt = system_prompt + "\n\n对话历史:\n"
-                                for msg in dialog_history:
-                                    execution_prompt += f"{msg['role']}: {msg['content']}\n"
-                                
-                                execution_prompt += "\n执行历史:\n"
-                                for entry in execution_history:
-                                    execution_prompt += f"{entry}\n"
-                                
-                                execution_prompt += f"\n当前执行步骤:\n{step_num}. {step_description}\n"
-                                execution_prompt += "\n请提供执行结果或工具调用。如果需要调用工具，请使用以下格式：工具名称(参数名=参数值, ...)"
-                                
-                                # 调用LLM生成执行行动
-                                step_response = await self.llm_service.generate_async(
-                                    prompt=execution_prompt,
-                                    temperature=0.5
-                                )
-                                
-                                # 检查是否包含工具调用
-                                if any(tool_name in step_response for tool_name in tool_map):
-                                    # 尝试提取工具调用
-                                    for tool_name in tool_map:
-                                        if tool_name in step_response:
-                                            self.logger.info(f"[Fallback-工具调用] 尝试调用工具: {tool_name}")
-                                            # 简单提取参数并调用工具
-                                            try:
-                                                # 简单的参数提取逻辑
-                                                if f"{tool_name}(" in step_response:
-                                                    # 尝试解析参数
-                                                    call_str = step_response.split(f"{tool_name}(")[1].split(")")[0]
-                                                    # 简单参数处理（实际可能需要更复杂的解析）
-                                                    params = {}
-                                                    if call_str.strip():
-                                                        for param in call_str.split(','):
-                                                            if '=' in param:
-                                                                key, value = param.split('=', 1)
-                                                                params[key.strip()] = value.strip(' "\'')
-
-                                                    # 如果是 search_video_by_vector 工具且没有 user_id 参数，自动注入
-                                                    if tool_name == "search_video_by_vector" and "user_id" not in params and extracted_user_id:
-                                                        params["user_id"] = extracted_user_id
-                                                        self.logger.info(f"[Fallback-工具调用] 自动注入 user_id: {extracted_user_id}")
-
-                                                    # 调用MCP工具，修复参数格式
-                                                    tool_response = await mcp_server.call_tool_async(
-                                                        tool_name=tool_name,
-                                                        parameters=params
-                                                    )
-                                                    if tool_response.success:
-                                                        tool_result = str(tool_response.result)
-                                                        self.logger.info(f"[Fallback-工具调用] 工具 {tool_name} 调用成功")
-                                                    else:
-                                                        tool_result = f"工具调用失败: {tool_response.error}"
-                                                        self.logger.error(f"[Fallback-工具调用] 工具 {tool_name} 调用失败: {tool_response.error}")
-                                                    
-                                                    execution_history.append(f"Step {step_num}: {step_description}")
-                                                    execution_history.append(f"Action: {tool_name}({call_str})")
-                                                    execution_history.append(f"Result: {tool_result}")
-
-                                                    # 发送步骤完成事件（不包含执行细节）
-                                                    if stream_callback:
-                                                        self.logger.info(f"[Fallback] 发送 step_complete 事件: 步骤{step_num}")
-                                                        await stream_callback({
-                                                            "type": "step_complete",
-                                                            "step_number": step_num
-                                                        })
-                                            except Exception as e:
-                                                self.logger.error(f"[Fallback-工具调用] 解析或调用工具 {tool_name} 失败: {str(e)}")
-                                            break
-                                else:
-                                    # 直接回答
-                                    execution_history.append(f"Step {step_num}: {step_description}")
-                                    execution_history.append(f"Result: {step_response.strip()}")
-
-                                    # 发送步骤完成事件（不包含执行细节）
-                                    if stream_callback:
-                                        self.logger.info(f"[Fallback] 发送 step_complete 事件: 步骤{step_num} (直接回答)")
-                                        await stream_callback({
-                                            "type": "step_complete",
-                                            "step_number": step_num
-                                        })
-                        
                         # 生成最终回答
-                        summary_prompt = system_prompt + "\n\n执行历史:\n"
-                        for entry in execution_history:
-                            summary_prompt += f"{entry}\n"
+                        summary_parts = ["执行历史:\n"]
+                        summary_parts.extend(f"{entry}\n" for entry in execution_history)
 
                         # 明确要求只返回结果，不重复过程
-                        summary_prompt += """
-
-## 重要提示：最终回答格式
-1. **不要重复上述执行计划和步骤过程**
-2. **直接提供用户需要的答案或结果**
-3. 如果查询到视频信息：
-   - 简短说明找到的视频（1-2句话）
-   - 使用<video_info>标签返回视频信息（严格按照之前的JSON格式）
-4. 如果是对话回答：
-   - 直接给出简洁的回答
-   - 不要说"基于上述步骤"、"经过分析"等过程性描述
-
-请提供最终答案："""
+                        summary_parts.append(_FALLBACK_SUMMARY_INSTRUCTIONS)
+                        summary_prompt = "".join(summary_parts)
 
                         final_response = await self.llm_service.generate_async(
                             prompt=summary_prompt,
+                            system_prompt=system_prompt,
                             temperature=0.5
                         )
 
                         # 过滤最终回答中的内部标记
-                        cleaned_response = self._clean_final_answer(final_response)
+                        cleaned_response = clean_final_answer(final_response)
 
                         return {"output": cleaned_response}
                     except Exception as e:
                         self.logger.error(f"[Planning-then-Execution模式-异常恢复] 处理失败: {str(e)}")
                         return {"output": "系统在处理您的请求时遇到技术问题，请稍后重试。"}
 
-                def _clean_final_answer(self, response):
-                    """清理最终答案，移除所有内部过程标记"""
-                    import re
-
-                    final_answer = response
-
-                    # 移除 Plan: 段落
-                    final_answer = re.sub(r'Plan:\s*\n(.*?)\n\n', '', final_answer, flags=re.DOTALL)
-                    final_answer = re.sub(r'Plan:.*?(?=\n\n|\Z)', '', final_answer, flags=re.DOTALL)
-
-                    # 移除 Reasoning: 段落
-                    final_answer = re.sub(r'Reasoning:\s*\n(.*?)\n\n', '', final_answer, flags=re.DOTALL)
-                    final_answer = re.sub(r'Reasoning:.*?(?=\n\n|\Z)', '', final_answer, flags=re.DOTALL)
-
-                    # 移除以 Step: 开头的整行
-                    final_answer = re.sub(r'^Step:\s*.*$', '', final_answer, flags=re.MULTILINE)
-                    final_answer = re.sub(r'\nStep:\s*.*$', '', final_answer, flags=re.MULTILINE)
-
-                    # 移除以 Action: 开头的整行
-                    final_answer = re.sub(r'^Action:\s*.*$', '', final_answer, flags=re.MULTILINE)
-                    final_answer = re.sub(r'\nAction:\s*.*$', '', final_answer, flags=re.MULTILINE)
-
-                    # 移除以 Result: 开头的整行
-                    final_answer = re.sub(r'^Result:\s*.*$', '', final_answer, flags=re.MULTILINE)
-                    final_answer = re.sub(r'\nResult:\s*.*$', '', final_answer, flags=re.MULTILINE)
-
-                    # 移除 Execution Complete: 标记
-                    final_answer = re.sub(r'Execution Complete:.*?\n', '', final_answer)
-                    final_answer = re.sub(r'^Execution Complete:\s*.*$', '', final_answer, flags=re.MULTILINE)
-
-                    # 移除 Final Answer: 标记
-                    final_answer = re.sub(r'^Final Answer:\s*', '', final_answer)
-                    final_answer = re.sub(r'\nFinal Answer:\s*', '\n', final_answer)
-
-                    # 清理多余的空白行
-                    final_answer = re.sub(r'\n\s*\n\s*\n', '\n\n', final_answer)
-                    final_answer = final_answer.strip()
-
-                    return final_answer
             
             return FallbackPlanningThenExecutionExecutor(self.config)
     
@@ -1263,26 +1947,16 @@ Final Answer: [对用户问题的最终回答]
             处理结果
         """
         try:
-            self.logger.info(f"[Planning-then-Execution模式] 开始处理请求: {request}")
+            self.logger.info("[Planning-then-Execution模式] 开始处理请求: %s", request)
             
             # 对于日期和时间类问题，我们可以直接获取系统时间（快速路径）
-            request_lower = request.lower()
-            if '今天几号' in request_lower or '日期' in request_lower:
-                import datetime
-                today = datetime.datetime.now().strftime('%Y年%m月%d日')
-                direct_answer = f"今天是{today}"
-                self.logger.info(f"[系统回答] 日期问题: {direct_answer}")
-                return direct_answer
-            elif '现在几点' in request_lower or '时间' in request_lower:
-                import datetime
-                current_time = datetime.datetime.now().strftime('%H:%M:%S')
-                direct_answer = f"现在是{current_time}"
-                self.logger.info(f"[系统回答] 时间问题: {direct_answer}")
+            direct_answer = _answer_datetime_question(request)
+            if direct_answer is not None:
                 return direct_answer
             
             # 所有其他问题都使用Planning-then-Execution模式的Agent执行器处理
             try:
-                self.logger.info(f"[Planning-then-Execution模式] 使用大模型和Planning-then-Execution流程处理问题")
+                self.logger.info("[Planning-then-Execution模式] 使用大模型和Planning-then-Execution流程处理问题")
                 
                 # 准备执行器输入 - 符合Planning-then-Execution模式的要求
                 inputs = {
@@ -1293,7 +1967,7 @@ Final Answer: [对用户问题的最终回答]
                 if chat_history:
                     inputs["chat_history"] = chat_history
                 
-                self.logger.info(f"[Planning-then-Execution模式] 调用Agent执行器 (Planning-then-Execution模式), 输入: {inputs}")
+                self.logger.info("[Planning-then-Execution模式] 调用Agent执行器 (Planning-then-Execution模式), 输入: %s", inputs)
                 
                 # 直接调用Agent执行器 - 这是Planning-then-Execution模式的核心循环
                 response = await self.agent_executor.ainvoke(inputs)
@@ -1305,11 +1979,11 @@ Final Answer: [对用户问题的最终回答]
                     # 新的执行器直接返回最终答案字符串
                     direct_answer = response
                 
-                self.logger.info(f"[Planning-then-Execution模式] 从执行结果中提取的回答: '{direct_answer}'")
+                self.logger.info("[Planning-then-Execution模式] 从执行结果中提取的回答: '%s'", direct_answer)
                 
                 # 确保有有效回答
                 if not direct_answer or direct_answer.strip() == "" or direct_answer == "无法生成响应":
-                    self.logger.warning(f"[Planning-then-Execution模式] 回答无效，使用备用回复")
+                    self.logger.warning("[Planning-then-Execution模式] 回答无效，使用备用回复")
                     direct_answer = f"根据您的问题: {request}，我无法提供具体回答。请尝试提供更多细节或换一种方式提问。"
                 
                 # 直接返回Planning-then-Execution模式生成的最终答案
@@ -1332,7 +2006,7 @@ Final Answer: [对用户问题的最终回答]
         重置Agent状态 - 简化版本
         """
         # 简单地重新创建Agent执行器
-        self.agent_executor = self._create_agent_executor()
+        self._agent_executor = self._create_agent_executor()
         self.logger.info("Agent state reset")
 
 
@@ -1348,22 +2022,50 @@ class AgentService:
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
-            cls._instance.agents = {}
+            cls._instance.logger = logger
+            # Agent实例ID -> Agent，只做弱引用，不再被使用的Agent可以被回收
+            cls._instance.agents = WeakValueDictionary()
+            # 按配置共享的Agent实例：(配置字段..., 工具注册表版本) -> Agent，按最近使用顺序排列
+            cls._instance._shared_agents = OrderedDict()
         return cls._instance
     
     def create_agent(self, config: Optional[AgentConfig] = None) -> Agent:
         """
-        创建Agent实例
-        
+        获取Agent实例
+
+        相同配置且工具注册表未变化时复用已构建好的Agent，避免每次请求都重新包装工具、创建执行器。
+
         Args:
             config: Agent配置
             
         Returns:
             Agent实例
         """
-        agent = Agent(config)
-        # 存储Agent实例
-        self.agents[id(agent)] = agent
+        config = config or AgentConfig()
+        tools_version = mcp_server.tools_version
+        config_key = (
+            config.name,
+            config.role,
+            config.description,
+            config.max_steps,
+            config.temperature,
+            tools_version
+        )
+        shared_agents = self._shared_agents
+        agent = shared_agents.get(config_key)
+        if agent is None:
+            # 工具注册表变化后旧版本的Agent不再复用
+            for stale_key in [key for key in shared_agents if key[-1] != tools_version]:
+                del shared_agents[stale_key]
+            # 配置种类超过上限时淘汰最久未使用的Agent
+            while len(shared_agents) >= settings.agent_max_shared_agents:
+                shared_agents.popitem(last=False)
+            agent = Agent(config)
+            shared_agents[config_key] = agent
+            # 存储Agent实例
+            self.agents[agent.agent_id] = agent
+        else:
+            shared_agents.move_to_end(config_key)
         return agent
     
     def get_agent(self, agent_id: int) -> Optional[Agent]:
@@ -1390,104 +2092,115 @@ class AgentService:
         Returns:
             包含处理结果和视频信息的字典 {"text": str, "video_info": List[Dict]}
         """
+        # 日期/时间问题在获取Agent和构造增强请求之前直接回答
+        direct_answer = _answer_datetime_question(request)
+        if direct_answer is not None:
+            return {"text": direct_answer, "video_info": []}
+
         # 创建增强的系统提示，要求大模型返回指定格式的视频信息
         if config is None:
             config = AgentConfig()
         
         # 使用请求包装器而不是修改Pydantic模型
         # 我们将视频信息格式要求直接添加到请求中
-        enhanced_request = f"""
-{request}
-
-## 重要提示：如果你需要返回视频信息，请使用以下JSON格式：
-<video_info>
-[
-    {{"video_id": "视频ID", "title": "视频标题", "thumbnail": "缩略图URL", "video_link": "视频链接", "relevance_score": 相关度分数}}
-]
-</video_info>
-
-请严格按照上述格式返回视频信息。如果没有视频信息，请不要包含<video_info>标签。
-"""
+        # 没有注册任何MCP工具时不可能返回视频信息，不附加格式说明以节省token
+        if mcp_server.tool_count:
+            enhanced_request = _ENHANCED_REQUEST_PREFIX + request + _VIDEO_INFO_INSTRUCTION
+        else:
+            enhanced_request = request
         
         agent = self.create_agent(config)
         result = await agent.process_request(enhanced_request, chat_history)
         
         # 解析结果，提取文本和视频信息
-        import re
         video_info_list = []
         
-        # 提取视频信息
-        video_info_match = re.search(r'<video_info>(.*?)</video_info>', result, re.DOTALL)
-        if video_info_match:
+        # 提取视频信息：一次扫描同时得到视频信息块和移除标签后的文本
+        raw_content, text_without_video_info = _split_video_info(result)
+        if raw_content is None:
+            text_content = result
+        else:
+            # 清理原文本，移除video_info标签
+            text_content = text_without_video_info.strip()
+            logger.info("原始视频信息内容长度: %d 字符", len(raw_content))
+            logger.info("原始视频信息内容前100字符: %.100s", raw_content)
             try:
-                import json
-                # 获取原始内容，包括所有换行和缩进
-                raw_content = video_info_match.group(1)
-                # 使用json.loads的默认行为处理多行JSON
-                logger.info(f"原始视频信息内容长度: {len(raw_content)} 字符")
-                logger.info(f"原始视频信息内容前100字符: {raw_content[:100]}")
-                
-                # 尝试直接解析
-                video_info_list = json.loads(raw_content)
-                logger.info(f"成功直接解析视频信息")
-                
-                # 确保是列表格式
-                if not isinstance(video_info_list, list):
-                    video_info_list = [video_info_list]
-                
-                # 清理原文本，移除video_info标签
-                text_content = re.sub(r'<video_info>.*?</video_info>', '', result, flags=re.DOTALL).strip()
-                logger.info(f"成功解析视频信息，数量: {len(video_info_list)}")
+                # 格式正确时直接解析（原始内容包括所有换行和缩进）
+                video_info_list = _loads_json(raw_content)
+                logger.info("成功直接解析视频信息")
             except json.JSONDecodeError:
-                try:
-                    # 备用方案1：移除空白字符和换行
-                    clean_content = ''.join(line.strip() for line in video_info_match.group(1).split('\n'))
-                    logger.info(f"尝试使用清理后的内容: {clean_content[:100]}...")
-                    
-                    # 检查是否有嵌套的video_info标签，如果有则提取最内层的
-                    nested_match = re.search(r'<video_info>(.*?)</video_info>', clean_content, re.DOTALL)
-                    if nested_match:
-                        clean_content = nested_match.group(1)
-                        logger.info(f"发现嵌套标签，提取内层内容: {clean_content[:100]}...")
-                    
-                    # 尝试只提取JSON部分（查找第一个'['和最后一个']'之间的内容）
-                    json_start = clean_content.find('[')
-                    json_end = clean_content.rfind(']')
-                    if json_start != -1 and json_end != -1:
-                        clean_content = clean_content[json_start:json_end+1]
-                        logger.info(f"提取JSON部分: {clean_content[:100]}...")
-                    
-                    video_info_list = json.loads(clean_content)
-                    # 确保是列表格式
-                    if not isinstance(video_info_list, list):
-                        video_info_list = [video_info_list]
-                    # 清理原文本
-                    text_content = re.sub(r'<video_info>.*?</video_info>', '', result, flags=re.DOTALL).strip()
-                    logger.info(f"使用清理后的内容成功解析，数量: {len(video_info_list)}")
-                except Exception as e2:
-                    # 如果还是失败，使用硬编码的示例数据进行测试
-                    logger.error(f"视频信息JSON解析失败，使用示例数据进行测试: {str(e2)}")
-                    video_info_list = [
-                        {
-                            "video_id": "test-video-1",
-                            "title": "测试视频",
-                            "thumbnail": "",
-                            "video_link": "/api/v1/videos/test-video-1",
-                            "relevance_score": 85
-                        }
-                    ]
-                    text_content = re.sub(r'<video_info>.*?</video_info>', '', result, flags=re.DOTALL).strip()
-            except Exception as e:
-                logger.error(f"处理视频信息时发生其他错误: {str(e)}")
-                text_content = result
-                video_info_list = []
-        else:
-            text_content = result
+                # 备用方案：去掉每行首尾空白（字符串值中的换行会导致JSON非法），
+                # 再单次扫描找出第一个括号配对完整的JSON数组/对象，只解析这一段
+                clean_content = ''.join(line.strip() for line in raw_content.split('\n'))
+                json_span = _find_json_span(clean_content)
+                if json_span is None:
+                    logger.error("视频信息中没有完整的JSON数组或对象: %.100s", clean_content)
+                else:
+                    clean_content = clean_content[json_span[0]:json_span[1]]
+                    logger.info("提取JSON部分: %.100s...", clean_content)
+                    try:
+                        video_info_list = _loads_json(clean_content)
+                    except json.JSONDecodeError as e:
+                        logger.error("视频信息JSON解析失败: %s", e)
+            # 确保是列表格式
+            if not isinstance(video_info_list, list):
+                video_info_list = [video_info_list]
+            logger.info("成功解析视频信息，数量: %d", len(video_info_list))
         
         return {
             "text": text_content,
             "video_info": video_info_list
         }
+
+    async def process_requests(
+        self,
+        requests: List[str],
+        chat_histories: Optional[List[Optional[List[Dict]]]] = None,
+        config: Optional[AgentConfig] = None,
+        max_concurrency: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        批量处理请求（评测、压测或突发的多用户请求），按并发上限同时处理
+
+        所有请求共享同一配置的Agent和LLM连接池。批量大小不能超过 agent_batch_max_requests，
+        并发数不超过 agent_batch_max_concurrency；固定数量的工作协程依次领取请求，不会一次创建全部任务。
+
+        Args:
+            requests: 用户请求列表
+            chat_histories: 与requests一一对应的聊天历史记录（可选）
+            config: Agent配置
+            max_concurrency: 同时处理的请求数上限（可选，不超过配置的上限）
+
+        Returns:
+            与requests顺序一致的结果列表，每项格式同 process_request
+
+        Raises:
+            ValueError: 请求数超过上限，或聊天历史与请求数量不一致
+        """
+        if len(requests) > settings.agent_batch_max_requests:
+            raise ValueError(
+                f"批量请求数 {len(requests)} 超过上限 {settings.agent_batch_max_requests}"
+            )
+        if chat_histories is not None and len(chat_histories) != len(requests):
+            raise ValueError("chat_histories 与 requests 数量不一致")
+
+        concurrency = settings.agent_batch_max_concurrency
+        if max_concurrency is not None:
+            concurrency = min(max_concurrency, concurrency)
+        concurrency = max(1, min(concurrency, len(requests)))
+
+        results: List[Optional[Dict[str, Any]]] = [None] * len(requests)
+        pending = iter(range(len(requests)))
+
+        async def worker() -> None:
+            # 各工作协程共享同一个下标迭代器，依次领取下一个未处理的请求
+            for index in pending:
+                chat_history = chat_histories[index] if chat_histories else None
+                results[index] = await self.process_request(requests[index], chat_history, config)
+
+        if requests:
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return results
     
     def reset_agent(self, agent_id: int):
         """
@@ -1506,6 +2219,7 @@ class AgentService:
         清除所有Agent实例
         """
         self.agents.clear()
+        self._shared_agents.clear()
         self.logger.info("All agents cleared")
 
 
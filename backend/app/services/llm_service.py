@@ -1,9 +1,10 @@
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, AsyncIterator, Iterator, Callable
 import logging
 import uuid
 import time
 import numpy as np
 import asyncio
+import threading
 from app.core.config import settings
 import json
 
@@ -24,11 +25,34 @@ except ImportError as e:
 # 尝试导入requests用于HTTP请求
 try:
     import requests
+    from requests.adapters import HTTPAdapter
     HAS_REQUESTS = True
 except ImportError:
     HAS_REQUESTS = False
     logger.warning("requests库未安装，无法使用HTTP请求")
 
+# 尝试导入orjson加速HTTP请求体和响应的JSON编解码
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+    logger.info("orjson未安装，LLM请求使用标准json库编解码")
+
+
+def _dumps_json(data: Any) -> bytes:
+    """将请求体序列化为UTF-8编码的JSON字节，可直接作为HTTP请求体发送"""
+    if HAS_ORJSON:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+def _loads_json(raw: Any) -> Any:
+    """解析JSON响应（bytes或str）"""
+    if HAS_ORJSON:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
 
 class VolcLLMService:
     """火山引擎LLM服务封装"""
@@ -36,7 +60,34 @@ class VolcLLMService:
     def __init__(self):
         self.client = None
         self.embeddings_client = None
+        # HTTP API模式下的连接池：所有线程共享同一个HTTPAdapter（其底层urllib3连接池是线程安全的），
+        # 复用keep-alive连接，避免每次请求重新建立TCP/TLS连接。requests.Session本身不保证线程安全，
+        # 调用会分布在MCP工具线程池、asyncio.to_thread工作线程和流式生产线程中，因此每个线程使用各自的会话，
+        # 会话之间只共享连接池
+        self._http_adapter = self._create_http_adapter() if HAS_REQUESTS else None
+        self._http_local = threading.local()
         self._initialize_client()
+
+    @staticmethod
+    def _create_http_adapter() -> "HTTPAdapter":
+        """创建按配置设定连接池大小的HTTP适配器"""
+        return HTTPAdapter(
+            pool_connections=settings.llm_http_pool_connections,
+            pool_maxsize=settings.llm_http_pool_maxsize
+        )
+
+    @property
+    def http_session(self) -> Optional["requests.Session"]:
+        """当前线程的HTTP会话，首次使用时创建并挂载共享的连接池适配器"""
+        if self._http_adapter is None:
+            return None
+        session = getattr(self._http_local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", self._http_adapter)
+            session.mount("http://", self._http_adapter)
+            self._http_local.session = session
+        return session
         
     def _initialize_client(self):
         """初始化火山引擎客户端（使用单一连接）"""
@@ -136,15 +187,15 @@ class VolcLLMService:
                 }
                 
                 logger.info(f"使用HTTP API调用LLM: {url}")
-                response = requests.post(
+                response = self.http_session.post(
                     url,
                     headers=headers,
-                    json=data,
+                    data=_dumps_json(data),
                     timeout=60  # 增加超时时间以适应较长的生成过程
                 )
                 
                 response.raise_for_status()  # 检查HTTP错误
-                result = response.json()
+                result = _loads_json(response.content)
                 
                 if "choices" in result and result["choices"] and "message" in result["choices"][0] and "content" in result["choices"][0]["message"]:
                     generated_text = result["choices"][0]["message"]["content"]
@@ -172,11 +223,12 @@ class VolcLLMService:
             logger.error(f"LLM生成失败: {str(e)}")
             raise
     
-    async def generate_async(self, prompt: str, 
+    async def generate_async(self, prompt: str = "", 
                            system_prompt: Optional[str] = None,
                            max_tokens: int = 2048,
                            temperature: float = 0.7,
                            top_p: float = 0.95,
+                           messages: Optional[List[Dict[str, str]]] = None,
                            **kwargs) -> str:
         """异步生成文本响应
         
@@ -186,6 +238,7 @@ class VolcLLMService:
             max_tokens: 最大令牌数
             temperature: 温度参数
             top_p: 核采样参数
+            messages: 完整的消息列表（可选），提供时原样发送，忽略prompt和system_prompt
             **kwargs: 其他参数
             
         Returns:
@@ -197,21 +250,23 @@ class VolcLLMService:
             logger.info("客户端未初始化，使用HTTP API模式")
         
         try:
-            # 准备消息列表
-            messages = []
-            
-            # 添加系统提示（如果有）
-            if system_prompt:
+            # 准备消息列表（调用方提供完整消息列表时保持消息边界不变）
+            if messages is None:
+                messages = []
+                
+                # 添加系统提示（如果有）
+                if system_prompt:
+                    messages.append({
+                        "role": "system",
+                        "content": system_prompt
+                    })
+                
+                # 添加用户提示
                 messages.append({
-                    "role": "system",
-                    "content": system_prompt
+                    "role": "user",
+                    "content": prompt
                 })
-            
-            # 添加用户提示
-            messages.append({
-                "role": "user",
-                "content": prompt
-            })
+            input_length = sum(len(message.get("content") or "") for message in messages)
             
             # 对于异步生成，我们需要使用线程池来执行同步操作
             loop = asyncio.get_event_loop()
@@ -244,22 +299,22 @@ class VolcLLMService:
                     }
                     
                     logger.info(f"异步使用HTTP API调用LLM: {url}")
-                    response = requests.post(
+                    response = self.http_session.post(
                         url,
                         headers=headers,
-                        json=data,
+                        data=_dumps_json(data),
                         timeout=60
                     )
                     
                     response.raise_for_status()
-                    return response.json()
+                    return _loads_json(response.content)
                 
                 # 执行HTTP API调用
                 result = await loop.run_in_executor(None, http_api_call)
                 
                 if "choices" in result and result["choices"] and "message" in result["choices"][0] and "content" in result["choices"][0]["message"]:
                     generated_text = result["choices"][0]["message"]["content"]
-                    logger.info(f"异步HTTP API LLM生成成功，输入长度: {len(prompt)}，输出长度: {len(generated_text)}")
+                    logger.info(f"异步HTTP API LLM生成成功，输入长度: {input_length}，输出长度: {len(generated_text)}")
                     return generated_text
                 else:
                     raise ValueError(f"Invalid LLM response structure: {result}")
@@ -279,13 +334,182 @@ class VolcLLMService:
                 
                 # 提取生成的文本
                 generated_text = response.choices[0].message.content
-                logger.info(f"异步SDK LLM生成成功，输入长度: {len(prompt)}，输出长度: {len(generated_text)}")
+                logger.info(f"异步SDK LLM生成成功，输入长度: {input_length}，输出长度: {len(generated_text)}")
                 return generated_text
             
         except Exception as e:
             logger.error(f"异步LLM生成失败: {str(e)}")
             raise
     
+    def _iter_stream_chunks(self, messages: List[Dict[str, str]],
+                            max_tokens: int,
+                            temperature: float,
+                            top_p: float,
+                            on_open: Optional[Callable[[Any], None]] = None,
+                            **kwargs) -> Iterator[str]:
+        """同步迭代流式生成的文本增量（SDK或HTTP SSE）
+
+        on_open 在上游HTTP响应或SDK流建立后以该对象调用，调用方可以在其他线程中关闭它，
+        使阻塞在读取上的迭代立即结束。
+        """
+        if self.client == "http_api_client":
+            if not HAS_REQUESTS:
+                logger.error("requests库未安装，无法使用HTTP API")
+                raise ImportError("请安装requests库: pip install requests")
+            
+            headers = {
+                "Authorization": f"Bearer {settings.volcengine_api_key}",
+                "Content-Type": "application/json",
+                "Accept": "text/event-stream"
+            }
+            url = f"{settings.volcengine_region}/chat/completions"
+            data = {
+                "model": settings.volcengine_model,
+                "messages": messages,
+                "max_tokens": max_tokens,
+                "temperature": temperature,
+                "top_p": top_p,
+                "stream": True,
+                **kwargs
+            }
+            
+            logger.info(f"流式使用HTTP API调用LLM: {url}")
+            with self.http_session.post(url, headers=headers, data=_dumps_json(data), timeout=60, stream=True) as response:
+                if on_open is not None:
+                    on_open(response)
+                response.raise_for_status()
+                # 按字节读取SSE行，JSON负载按UTF-8解析：响应头没有charset时requests会按ISO-8859-1解码，导致中文乱码
+                for line in response.iter_lines():
+                    if not line.startswith(b"data:"):
+                        continue
+                    payload = line[5:].strip()
+                    if payload == b"[DONE]":
+                        break
+                    chunk = _loads_json(payload)
+                    choices = chunk.get("choices") or []
+                    if choices:
+                        delta = (choices[0].get("delta") or {}).get("content")
+                        if delta:
+                            yield delta
+        else:
+            stream = self.client.chat.completions.create(
+                model=settings.volcengine_model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                stream=True,
+                **kwargs
+            )
+            if on_open is not None:
+                on_open(stream)
+            try:
+                for chunk in stream:
+                    if chunk.choices:
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            yield delta
+            finally:
+                # 提前停止迭代时关闭底层HTTP响应
+                close = getattr(stream, "close", None)
+                if close is not None:
+                    close()
+    
+    async def generate_stream_async(self, prompt: str = "",
+                                    system_prompt: Optional[str] = None,
+                                    max_tokens: int = 2048,
+                                    temperature: float = 0.7,
+                                    top_p: float = 0.95,
+                                    messages: Optional[List[Dict[str, str]]] = None,
+                                    **kwargs) -> AsyncIterator[str]:
+        """异步流式生成文本响应，逐个产出文本增量
+        
+        Args:
+            prompt: 用户提示
+            system_prompt: 系统提示（可选）
+            max_tokens: 最大令牌数
+            temperature: 温度参数
+            top_p: 核采样参数
+            messages: 完整的消息列表（可选），提供时原样发送，忽略prompt和system_prompt
+            **kwargs: 其他参数
+            
+        Yields:
+            生成文本的增量片段
+        """
+        if self.client is None:
+            self.client = "http_api_client"
+            logger.info("客户端未初始化，使用HTTP API模式")
+        
+        if messages is None:
+            messages = []
+            if system_prompt:
+                messages.append({
+                    "role": "system",
+                    "content": system_prompt
+                })
+            messages.append({
+                "role": "user",
+                "content": prompt
+            })
+        input_length = sum(len(message.get("content") or "") for message in messages)
+        
+        # 同步的流式迭代在线程池中执行，增量片段通过队列交回事件循环
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+        # 调用方提前关闭生成器时通知生产线程停止读取并关闭上游响应
+        stop = threading.Event()
+        # 生产线程打开的HTTP响应或SDK流：调用方提前停止时直接关闭，不等生产线程读到下一个增量
+        upstream = []
+        upstream_lock = threading.Lock()
+        
+        def register_upstream(resource):
+            with upstream_lock:
+                upstream.append(resource)
+                stopped = stop.is_set()
+            if stopped:
+                resource.close()
+        
+        def produce():
+            chunks = self._iter_stream_chunks(
+                messages, max_tokens, temperature, top_p, on_open=register_upstream, **kwargs
+            )
+            try:
+                for delta in chunks:
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, delta)
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                chunks.close()
+        
+        producer = loop.run_in_executor(None, produce)
+        total_length = 0
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    logger.error(f"异步流式LLM生成失败: {str(item)}")
+                    raise item
+                total_length += len(item)
+                yield item
+        finally:
+            with upstream_lock:
+                stop.set()
+                resources = list(upstream)
+            # 关闭上游连接：生产线程阻塞中的读取立即出错返回，连接不再等模型生成完剩余内容
+            for resource in resources:
+                try:
+                    resource.close()
+                except Exception as e:
+                    logger.debug("关闭流式响应失败: %s", e)
+            await producer
+        logger.info(f"异步流式LLM生成成功，输入长度: {input_length}，输出长度: {total_length}")
+    
     def generate_summary(self, content: str, max_length: int = 500) -> str:
         """生成文本摘要
         
@@ -487,15 +711,15 @@ class VolcLLMService:
                     }
                     
                     logger.info(f"使用HTTP请求调用embedding API: {url}")
-                    response = requests.post(
+                    response = self.http_session.post(
                         url,
                         headers=headers,
-                        json=data,
+                        data=_dumps_json(data),
                         timeout=30
                     )
                     
                     response.raise_for_status()  # 检查HTTP错误
-                    result = response.json()
+                    result = _loads_json(response.content)
                     
                     if "data" in result and result["data"] and "embedding" in result["data"][0]:
                         embedding = result["data"][0]["embedding"]
@@ -565,10 +789,10 @@ class VolcLLMService:
                 }
                 
                 url = "https://ark.cn-beijing.volces.com/api/v3/embeddings"
-                response = requests.post(url, headers=headers, json=data, timeout=60)
+                response = self.http_session.post(url, headers=headers, data=_dumps_json(data), timeout=60)
                 response.raise_for_status()
                 
-                result = response.json()
+                result = _loads_json(response.content)
                 
                 # 验证响应格式
                 if "data" not in result or not isinstance(result["data"], list):
@@ -0,0 +1,409 @@
+"""
+Agent计划缓存
+
+缓存Planning阶段生成的执行计划和最终答案，对重复或语义相近的用户请求直接复用，
+跳过规划阶段的大模型调用。命中判断分两级：先按 (对话历史摘要, 规范化后的请求文本) 精确匹配，
+未命中且没有对话历史时，再用文本向量的余弦相似度做语义匹配（默认关闭）。
+
+计划以模板形式存储：请求中的具体取值（引号或书名号内的内容、英文单词和数字串）在计划文本中
+替换为占位符，命中时用当前请求的取值回填。语义命中只复用计划结构，缓存的计划中只要还含有
+原请求特有、当前请求没有的内容，就不复用。
+"""
+
+import asyncio
+import hashlib
+import logging
+import re
+import time
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 请求中附加的用户ID信息，不参与缓存键计算
+_USER_ID_RE = re.compile(r'当前用户ID:\s*([a-zA-Z0-9_-]+)')
+# 计划中工具调用的 user_id 参数，写入缓存前替换为用户占位符
+_USER_ID_ARG_RE = re.compile(r'(\buser_id\s*=\s*)(?:"[^"\n]*"|\'[^\'\n]*\'|[^,)\s]+)')
+# 服务端在用户请求末尾追加的固定说明：视频信息返回格式（agent_service._VIDEO_INFO_INSTRUCTION 及
+# agent_routes 中的同一段文字）和用户视频范围限制。只去掉末尾完整匹配的这两段，用户请求自身的 "## " 标题保留
+_VIDEO_INFO_SUFFIX = (
+    r'## 重要提示：如果你需要返回视频信息，请使用以下JSON格式：\n<video_info>\n.*?\n</video_info>\n\n'
+    r'请严格按照上述格式返回视频信息。如果没有视频信息，请不要包含<video_info>标签。'
+)
+_USER_SCOPE_SUFFIX = (
+    r'## 用户视频范围限制\n当前用户ID: [a-zA-Z0-9_-]+\n.*?'
+    r'search_video_by_vector\(query="用户的搜索词", top_k=10, user_id="[a-zA-Z0-9_-]+"\)'
+)
+_SERVICE_SUFFIX_RE = re.compile(
+    rf'\s*(?:{_VIDEO_INFO_SUFFIX}\s*)?(?:{_USER_SCOPE_SUFFIX}\s*)?\Z',
+    re.DOTALL
+)
+_WHITESPACE_RE = re.compile(r'\s+')
+# 请求中的具体取值：引号/书名号内的内容，或至少两个字符的英文单词、数字串
+_LITERAL_RE = re.compile(
+    r'"([^"\n]+)"|“([^”\n]+)”|\'([^\'\n]+)\'|《([^》\n]+)》|([A-Za-z0-9_][A-Za-z0-9_.\-]*[A-Za-z0-9_])'
+)
+# 计划模板中的占位符，编号对应请求中取值出现的顺序
+_SLOT_RE = re.compile('\ue000(\\d+)\ue001')
+# 计划模板中的用户占位符，命中时回填当前请求的用户ID
+_USER_SLOT = '\ue002'
+# 比较两个请求的差异内容时忽略的常见虚词
+_COMMON_CHARS = frozenset("的了吗呢吧啊和与及或在是有关于一个些这那请帮我你们给")
+
+
+class PlanCache:
+    """
+    执行计划缓存
+
+    以 (对话历史摘要, 规范化后的用户请求) 为键缓存 (计划步骤, 推理过程, 步骤依赖)，
+    并以 (对话历史摘要, 请求, 计划步骤, 执行历史) 为键缓存最终答案。同一请求在不同对话上下文中
+    （如 "再详细一点" 这类追问）不会互相命中。
+    写入的计划把用户ID和请求中的具体取值替换为占位符，命中时用当前请求的用户ID和取值回填，
+    不同用户的相同请求不会拿到彼此的用户ID。
+    所有条目在TTL到期后失效，超过容量上限时淘汰最旧的条目。
+    """
+
+    def __init__(
+        self,
+        similarity_threshold: float = 0.92,
+        ttl_seconds: float = 3600,
+        max_entries: int = 256,
+        embed_fn: Optional[Callable[[str], List[float]]] = None
+    ):
+        """
+        初始化计划缓存
+
+        Args:
+            similarity_threshold: 语义匹配的余弦相似度阈值
+            ttl_seconds: 缓存条目有效期（秒）
+            max_entries: 最大缓存条目数
+            embed_fn: 文本向量化函数（同步），为None时只做精确匹配
+        """
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.embed_fn = embed_fn
+        # 计划键 -> (写入时间, 计划步骤模板, 推理过程模板, 步骤依赖, 归一化向量, 取值个数, 请求内容字符)
+        self._plans: Dict[str, Tuple[
+            float, List[str], str, Optional[List[Optional[List[int]]]], Optional[np.ndarray], int, FrozenSet[str]
+        ]] = {}
+        # 答案键 -> (写入时间, 最终答案)
+        self._answers: Dict[str, Tuple[float, str]] = {}
+
+    @staticmethod
+    def _query_text(user_input: str) -> str:
+        """去掉服务端追加在请求末尾的固定说明和用户ID，并合并空白字符"""
+        text = user_input
+        suffix = _SERVICE_SUFFIX_RE.search(text)
+        if suffix is not None:
+            text = text[:suffix.start()]
+        text = _USER_ID_RE.sub('', text)
+        return _WHITESPACE_RE.sub(' ', text).strip()
+
+    @classmethod
+    def normalize(cls, user_input: str) -> str:
+        """
+        规范化用户请求，只保留真正的查询内容
+
+        Args:
+            user_input: 原始用户输入
+
+        Returns:
+            规范化后的请求文本（小写）
+        """
+        return cls._query_text(user_input).lower()
+
+    @staticmethod
+    def _request_user_id(user_input: str) -> str:
+        """请求中附加的用户ID，没有时返回空字符串"""
+        match = _USER_ID_RE.search(user_input)
+        return match.group(1) if match else ""
+
+    @staticmethod
+    def _extract_literals(query: str) -> List[str]:
+        """按出现顺序提取请求中的具体取值（忽略大小写去重）"""
+        literals: List[str] = []
+        seen = set()
+        for match in _LITERAL_RE.finditer(query):
+            literal = next(group for group in match.groups() if group)
+            if literal.lower() not in seen:
+                seen.add(literal.lower())
+                literals.append(literal)
+        return literals
+
+    @staticmethod
+    def _content_chars(query: str) -> FrozenSet[str]:
+        """请求中去掉具体取值后的内容字符（不含空白和常见虚词）"""
+        content = _LITERAL_RE.sub(' ', query).lower()
+        return frozenset(ch for ch in content if not ch.isspace() and ch not in _COMMON_CHARS)
+
+    @staticmethod
+    def _to_templates(texts: List[str], literals: List[str], user_id: str = "") -> List[str]:
+        """把计划文本中的用户ID替换为用户占位符，请求取值替换为取值占位符"""
+        texts = [_USER_ID_RE.sub('', text) for text in texts]
+        texts = [_USER_ID_ARG_RE.sub(rf'\1"{_USER_SLOT}"', text) for text in texts]
+        index = {literal.lower(): i for i, literal in enumerate(literals)}
+        if user_id and user_id.lower() not in index:
+            # 推理过程等文本中出现的用户ID同样不能带给其他用户
+            pattern = re.compile(rf'(?<![A-Za-z0-9_-]){re.escape(user_id)}(?![A-Za-z0-9_-])')
+            texts = [pattern.sub(_USER_SLOT, text) for text in texts]
+        if literals:
+            alternatives = '|'.join(re.escape(literal) for literal in sorted(literals, key=len, reverse=True))
+            pattern = re.compile(rf'(?<![A-Za-z0-9_])({alternatives})(?![A-Za-z0-9_])', re.IGNORECASE)
+            texts = [
+                pattern.sub(lambda match: f"\ue000{index[match.group(1).lower()]}\ue001", text)
+                for text in texts
+            ]
+        return [_WHITESPACE_RE.sub(' ', text).strip() for text in texts]
+
+    @staticmethod
+    def _fill_template(template: str, literals: List[str], user_id: str) -> str:
+        return _SLOT_RE.sub(lambda match: literals[int(match.group(1))], template).replace(_USER_SLOT, user_id)
+
+    def _fill_entry(
+        self, entry, literals: List[str], user_id: str
+    ) -> Tuple[List[str], str, Optional[List[Optional[List[int]]]]]:
+        steps = [self._fill_template(step, literals, user_id) for step in entry[1]]
+        return steps, self._fill_template(entry[2], literals, user_id), entry[3]
+
+    @staticmethod
+    def _carries_cached_content(entry, content_chars: FrozenSet[str]) -> bool:
+        """缓存的计划中是否含有原请求特有、当前请求中没有的内容"""
+        extra = entry[6] - content_chars
+        if not extra:
+            return False
+        template_text = _SLOT_RE.sub(' ', ' '.join([*entry[1], entry[2]])).lower()
+        return any(ch in extra for ch in template_text)
+
+    @staticmethod
+    def digest_history(chat_history: Optional[List[Dict[str, str]]]) -> str:
+        """
+        计算对话历史摘要，作为缓存键的一部分
+
+        Args:
+            chat_history: 对话历史消息列表（每条包含role和content）
+
+        Returns:
+            对话历史的摘要，没有对话历史时返回空字符串
+        """
+        if not chat_history:
+            return ""
+        digest = hashlib.sha1()
+        for msg in chat_history:
+            digest.update(str(msg.get('role', '')).encode('utf-8'))
+            digest.update(b'\x00')
+            digest.update(str(msg.get('content', '')).encode('utf-8'))
+            digest.update(b'\x01')
+        return digest.hexdigest()
+
+    @staticmethod
+    def _plan_key(normalized: str, history_digest: str) -> str:
+        return f"{history_digest}\x00{normalized}" if history_digest else normalized
+
+    def _is_fresh(self, created_at: float) -> bool:
+        return time.monotonic() - created_at < self.ttl_seconds
+
+    async def _embed(self, text: str) -> Optional[np.ndarray]:
+        """计算归一化文本向量，失败时返回None（退化为精确匹配）"""
+        if self.embed_fn is None:
+            return None
+        try:
+            vector = np.asarray(await asyncio.to_thread(self.embed_fn, text), dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            if norm == 0:
+                return None
+            return vector / norm
+        except Exception as e:
+            logger.warning(f"[计划缓存] 计算请求向量失败，仅使用精确匹配: {str(e)}")
+            return None
+
+    async def get_plan(
+        self,
+        user_input: str,
+        history_digest: str = ""
+    ) -> Tuple[Optional[Tuple[List[str], str, Optional[List[Optional[List[int]]]]]], Optional[np.ndarray]]:
+        """
+        查询缓存的执行计划
+
+        Args:
+            user_input: 原始用户输入
+            history_digest: digest_history 计算的对话历史摘要
+
+        Returns:
+            ((计划步骤, 推理过程, 步骤依赖) 或 None, 请求向量)。请求向量可传给 put_plan 以避免重复计算
+        """
+        query = self._query_text(user_input)
+        normalized = query.lower()
+        if not normalized:
+            return None, None
+        literals = self._extract_literals(query)
+        user_id = self._request_user_id(user_input)
+
+        key = self._plan_key(normalized, history_digest)
+        entry = self._plans.get(key)
+        if entry is not None:
+            if self._is_fresh(entry[0]) and entry[5] == len(literals):
+                logger.info("[计划缓存] 精确命中")
+                return self._fill_entry(entry, literals, user_id), entry[4]
+            del self._plans[key]
+
+        # 有对话历史的请求往往依赖上下文（追问、指代），只做精确匹配，也不为其计算向量
+        if history_digest:
+            return None, None
+
+        vector = await self._embed(normalized)
+        if vector is None:
+            return None, None
+
+        # 语义匹配只复用计划结构：取值个数要一致（占位符可全部回填），
+        # 且计划中不能含有原请求特有、当前请求没有的内容（如不同的检索主题）
+        content_chars = self._content_chars(query)
+        best_similarity = -1.0
+        best_entry = None
+        for cached_key, entry in list(self._plans.items()):
+            if not self._is_fresh(entry[0]):
+                del self._plans[cached_key]
+                continue
+            cached_vector = entry[4]
+            if cached_vector is None or entry[5] != len(literals):
+                continue
+            similarity = float(np.dot(vector, cached_vector))
+            if (similarity >= self.similarity_threshold and similarity > best_similarity
+                    and not self._carries_cached_content(entry, content_chars)):
+                best_similarity = similarity
+                best_entry = entry
+
+        if best_entry is not None:
+            logger.info(f"[计划缓存] 语义命中 similarity={best_similarity:.3f}")
+            return self._fill_entry(best_entry, literals, user_id), vector
+        return None, vector
+
+    def put_plan(
+        self,
+        user_input: str,
+        plan_steps: List[str],
+        reasoning: str,
+        vector: Optional[np.ndarray] = None,
+        dependencies: Optional[List[Optional[List[int]]]] = None,
+        history_digest: str = ""
+    ) -> None:
+        """
+        写入执行计划（应在计划执行成功后调用）
+
+        Args:
+            user_input: 原始用户输入
+            plan_steps: 计划步骤
+            reasoning: 推理过程
+            vector: get_plan 返回的请求向量（可选）
+            dependencies: 步骤依赖关系（可选）
+            history_digest: digest_history 计算的对话历史摘要
+        """
+        query = self._query_text(user_input)
+        normalized = query.lower()
+        if not normalized or not plan_steps:
+            return
+        key = self._plan_key(normalized, history_digest)
+        if key not in self._plans and len(self._plans) >= self.max_entries:
+            oldest = min(self._plans, key=lambda k: self._plans[k][0])
+            del self._plans[oldest]
+        literals = self._extract_literals(query)
+        *steps, reasoning_template = self._to_templates(
+            [*plan_steps, reasoning], literals, self._request_user_id(user_input)
+        )
+        self._plans[key] = (
+            time.monotonic(), steps, reasoning_template, dependencies, vector,
+            len(literals), self._content_chars(query)
+        )
+
+    def _answer_key(self, user_input: str, plan_steps: List[str], execution_history: List[str], history_digest: str) -> str:
+        digest = hashlib.sha1(self._plan_key(self.normalize(user_input), history_digest).encode('utf-8'))
+        digest.update(b'\x01')
+        for part in plan_steps:
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\x00')
+        digest.update(b'\x01')
+        for part in execution_history:
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\x00')
+        return digest.hexdigest()
+
+    def get_answer(
+        self,
+        user_input: str,
+        plan_steps: List[str],
+        execution_history: List[str],
+        history_digest: str = ""
+    ) -> Optional[str]:
+        """
+        查询缓存的最终答案
+
+        Args:
+            user_input: 原始用户输入
+            plan_steps: 计划步骤
+            execution_history: 执行历史（包含工具返回结果）
+            history_digest: digest_history 计算的对话历史摘要
+
+        Returns:
+            最终答案或None
+        """
+        key = self._answer_key(user_input, plan_steps, execution_history, history_digest)
+        entry = self._answers.get(key)
+        if entry is None:
+            return None
+        if not self._is_fresh(entry[0]):
+            del self._answers[key]
+            return None
+        logger.info("[计划缓存] 最终答案命中")
+        return entry[1]
+
+    def put_answer(
+        self,
+        user_input: str,
+        plan_steps: List[str],
+        execution_history: List[str],
+        final_answer: str,
+        history_digest: str = ""
+    ) -> None:
+        """
+        写入最终答案
+
+        Args:
+            user_input: 原始用户输入
+            plan_steps: 计划步骤
+            execution_history: 执行历史
+            final_answer: 最终答案
+            history_digest: digest_history 计算的对话历史摘要
+        """
+        key = self._answer_key(user_input, plan_steps, execution_history, history_digest)
+        if key not in self._answers and len(self._answers) >= self.max_entries:
+            oldest = min(self._answers, key=lambda k: self._answers[k][0])
+            del self._answers[oldest]
+        self._answers[key] = (time.monotonic(), final_answer)
+
+    def clear(self) -> None:
+        """清空所有缓存条目"""
+        self._plans.clear()
+        self._answers.clear()
+
+
+def _embed_text(text: str) -> List[float]:
+    """使用火山引擎embedding接口向量化文本（只尝试一次，失败时由调用方降级）"""
+    from app.services.llm_service import llm_service
+    return llm_service.generate_embedding(text, retry_attempts=1)
+
+
+# 创建全局计划缓存实例
+plan_cache = PlanCache(
+    similarity_threshold=settings.agent_plan_cache_similarity,
+    ttl_seconds=settings.agent_plan_cache_ttl,
+    embed_fn=_embed_text if settings.agent_plan_cache_semantic else None
+)
+
+
+__all__ = [
+    'PlanCache',
+    'plan_cache'
+]
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Agent输出解析函数测试脚本
+
+测试 parse_tool_params 对大模型可能生成的异常参数的处理：无法求值的字面量要退回源文本，不能抛出异常；
+parse_plan_with_reasoning 对编号不连续、含嵌套子项的计划的解析；以及 FinalAnswerStream 在标记被拆分到
+不同增量片段时的过滤。
+使用方法：python test_agent_parsers.py 或 pytest test_agent_parsers.py
+"""
+
+import importlib.util
+import os
+import sys
+
+# 直接按文件加载解析模块：导入 app 包会创建FastAPI应用并连接数据库，解析函数本身不依赖这些
+_PARSERS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app", "services", "agent_parsers.py")
+_spec = importlib.util.spec_from_file_location("agent_parsers", _PARSERS_PATH)
+agent_parsers = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(agent_parsers)
+parse_tool_params = agent_parsers.parse_tool_params
+parse_plan_with_reasoning = agent_parsers.parse_plan_with_reasoning
+FinalAnswerStream = agent_parsers.FinalAnswerStream
+
+
+def test_literal_params():
+    """普通字面量参数保留类型"""
+    params = parse_tool_params('query="人工智能", top_k=5, exact=True')
+    assert params == {"query": "人工智能", "top_k": 5, "exact": True}
+
+
+def test_unhashable_dict_key_falls_back_to_source():
+    """不可哈希的字典键（literal_eval 抛出 TypeError）保留源文本"""
+    params = parse_tool_params('query="a", x={[1]:2}')
+    assert params["query"] == "a"
+    assert params["x"] == "{[1]:2}"
+
+
+def test_non_literal_falls_back_to_source():
+    """非字面量表达式保留源文本"""
+    params = parse_tool_params('query=user_query, top_k=5')
+    assert params == {"query": "user_query", "top_k": 5}
+
+
+def test_deeply_nested_value_does_not_raise():
+    """嵌套过深的参数不抛出 RecursionError/MemoryError"""
+    nested = "[" * 100000 + "]" * 100000
+    params = parse_tool_params(f'query="a", x={nested}')
+    assert isinstance(params, dict)
+
+
+def test_syntax_error_falls_back_to_regex():
+    """语法错误时按 key=value 正则解析"""
+    params = parse_tool_params('query="机器学习", top_k=5,,')
+    assert params["query"] == "机器学习"
+    assert params["top_k"] == "5"
+
+
+def test_plan_dependencies_with_gapped_numbering():
+    """计划编号不连续时，依赖标注中的编号换算为步骤位置"""
+    steps, _, deps = parse_plan_with_reasoning("Plan:\n1. a\n3. b (依赖: 1)\n5. c (依赖: 3)\nReasoning: r")
+    assert steps == ["a", "b", "c"]
+    assert deps == [None, [1], [2]]
+
+
+def test_plan_dependency_on_missing_step_is_dropped():
+    """引用不存在的编号的依赖忽略"""
+    _, _, deps = parse_plan_with_reasoning("Plan:\n1. a\n2. b (依赖: 1, 7)")
+    assert deps == [None, [1]]
+
+
+def test_plan_nested_items_are_not_steps():
+    """缩进的编号子项不算计划步骤"""
+    response = "Plan:\n1. 检索视频\n   1. 按标题检索\n   2. 按内容检索\n2. 总结结果 (依赖: 1)\nReasoning: r"
+    steps, reasoning, deps = parse_plan_with_reasoning(response)
+    assert steps == ["检索视频", "总结结果"]
+    assert reasoning == "r"
+    assert deps == [None, [1]]
+
+
+def _feed_all(deltas):
+    answer_stream = FinalAnswerStream()
+    return [answer_stream.feed(delta) for delta in deltas]
+
+
+def test_final_answer_stream_skips_text_before_marker():
+    """Final Answer: 之前的内容不输出，拆分在两个片段中的标记也能识别"""
+    outputs = _feed_all(["Step: 总结\nFinal An", "swer:  猫", "的视频有3个"])
+    assert outputs == ["", "猫", "的视频有3个"]
+
+
+def test_final_answer_stream_drops_video_info():
+    """<video_info>块被拆分在多个片段中时整块去掉"""
+    deltas = ["Final Answer: 找到视频<vid", "eo_info>\n[{\"video_id\": \"1\"}]\n</video", "_info>\n以上。"]
+    assert "".join(_feed_all(deltas)) == "找到视频\n以上。"
+
+
+def test_final_answer_stream_keeps_plain_angle_brackets():
+    """不是标记开头的 "<" 照常输出"""
+    outputs = _feed_all(["Final Answer: a <", " b"])
+    assert "".join(outputs) == "a < b"
+
+
+def test_final_answer_stream_without_marker_outputs_nothing():
+    """没有 Final Answer: 标记时不输出，由完成事件返回答案"""
+    assert _feed_all(["Plan:\n1. a", "\nReasoning: r"]) == ["", ""]
+
+
+if __name__ == "__main__":
+    tests = [value for name, value in list(globals().items()) if name.startswith("test_") and callable(value)]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"✗ {test.__name__}: {type(e).__name__}: {e}")
+    sys.exit(1 if failed else 0)
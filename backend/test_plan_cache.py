@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+执行计划缓存测试脚本
+
+测试不同用户发送相同请求时，缓存的计划不会把上一个用户的用户ID带给下一个用户。
+使用方法：python test_plan_cache.py 或 pytest test_plan_cache.py
+"""
+
+import asyncio
+import os
+import sys
+import types
+
+# 只登记 app 包路径而不执行 app/__init__.py：导入 app 包会创建FastAPI应用并连接数据库，计划缓存本身不依赖这些
+_BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+for _name, _path in (("app", "app"), ("app.core", os.path.join("app", "core")),
+                     ("app.services", os.path.join("app", "services"))):
+    if _name not in sys.modules:
+        _package = types.ModuleType(_name)
+        _package.__path__ = [os.path.join(_BACKEND_DIR, _path)]
+        sys.modules[_name] = _package
+
+from app.services.plan_cache import PlanCache
+
+
+def _user_request(message: str, user_id: str) -> str:
+    """按 agent_routes 的格式构造附加了用户视频范围限制的请求"""
+    user_video_info = (
+        f"\n## 用户视频范围限制\n"
+        f"当前用户ID: {user_id}\n"
+        f"**重要**: 调用 search_video_by_vector 工具时，必须传递 user_id 参数来限制搜索范围。\n"
+        f"调用示例:\n"
+        f"search_video_by_vector(query=\"用户的搜索词\", top_k=10, user_id=\"{user_id}\")\n"
+    )
+    return f"\n{message}\n{user_video_info}"
+
+
+def test_same_query_from_two_users():
+    """用户u2命中用户u1写入的计划时，工具参数和推理过程中的用户ID都换成u2"""
+    cache = PlanCache()
+    cache.put_plan(
+        _user_request("搜索关于猫的视频", "u1"),
+        ['search_video_by_vector(query="猫", top_k=10, user_id="u1")', "总结用户u1的搜索结果"],
+        "为用户u1检索视频"
+    )
+
+    cached, _ = asyncio.run(cache.get_plan(_user_request("搜索关于猫的视频", "u2")))
+    assert cached is not None
+    steps, reasoning, _ = cached
+    assert steps == ['search_video_by_vector(query="猫", top_k=10, user_id="u2")', "总结用户u2的搜索结果"]
+    assert reasoning == "为用户u2检索视频"
+
+
+def test_user_id_argument_forms():
+    """单引号、无引号以及位于第一个参数的 user_id 都替换为当前用户"""
+    cache = PlanCache()
+    cache.put_plan(
+        _user_request("搜索关于狗的视频", "user_1"),
+        ["search_video_by_vector(user_id='user_1', query=\"狗\")",
+         "search_video_by_vector(query=\"狗\", user_id=user_1)"],
+        ""
+    )
+
+    cached, _ = asyncio.run(cache.get_plan(_user_request("搜索关于狗的视频", "user_2")))
+    assert cached is not None
+    steps = cached[0]
+    assert steps == ['search_video_by_vector(user_id="user_2", query="狗")',
+                     'search_video_by_vector(query="狗", user_id="user_2")']
+    assert all("user_1" not in step for step in steps)
+
+
+if __name__ == "__main__":
+    tests = [value for name, value in list(globals().items()) if name.startswith("test_") and callable(value)]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✓ {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"✗ {test.__name__}: {type(e).__name__}: {e}")
+    sys.exit(1 if failed else 0)
@@ -783,6 +783,15 @@ function App() {
           }));
         },
 
+        onToken: (data) => {
+          // 最终答案逐段追加到AI消息，完成事件到达后替换为完整答案
+          setMessages(prev => prev.map(msg =>
+            msg.id === aiMessageId
+              ? { ...msg, text: (msg.text || '') + data.delta }
+              : msg
+          ));
+        },
+
         onComplete: (data) => {
           console.log('完成:', data);
           // 更新最终消息
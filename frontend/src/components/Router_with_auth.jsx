@@ -640,6 +640,9 @@ const RouterWithAuth = () => {
       };
       setMessages(prev => [...prev, userMessage]);
 
+      // 最终答案流式输出时使用的AI消息ID，收到第一个片段时创建
+      let answerMessageId = null;
+
       // 💡 调用WebSocket流式API - 真正的实时流式，不受localhost缓冲影响
       await apiService.agent.sendMessageWebSocket(message, {
         onPlanningStart: (data) => {
@@ -716,16 +719,44 @@ const RouterWithAuth = () => {
           });
         },
 
+        onToken: (data) => {
+          // 最终答案逐段追加到同一条AI消息，完成事件到达后替换为完整答案
+          flushSync(() => {
+            if (answerMessageId === null) {
+              answerMessageId = Date.now();
+              const id = answerMessageId;
+              setMessages(prev => [...prev, {
+                id,
+                text: data.delta,
+                sender: 'ai',
+                timestamp: new Date().toLocaleTimeString()
+              }]);
+            } else {
+              const id = answerMessageId;
+              setMessages(prev => prev.map(msg =>
+                msg.id === id ? { ...msg, text: msg.text + data.delta } : msg
+              ));
+            }
+          });
+        },
+
         onComplete: (data) => {
           console.log('完成:', data);
+          const finalMessage = {
+            text: data.final_answer || '处理完成',
+            sender: 'ai',
+            timestamp: new Date().toLocaleTimeString(),
+            videoResults: data.video_info || []
+          };
           flushSync(() => {
-            setMessages(prev => [...prev, {
-              id: Date.now(),
-              text: data.final_answer || '处理完成',
-              sender: 'ai',
-              timestamp: new Date().toLocaleTimeString(),
-              videoResults: data.video_info || []
-            }]);
+            if (answerMessageId === null) {
+              setMessages(prev => [...prev, { id: Date.now(), ...finalMessage }]);
+            } else {
+              const id = answerMessageId;
+              setMessages(prev => prev.map(msg =>
+                msg.id === id ? { ...msg, ...finalMessage } : msg
+              ));
+            }
             setIsLoading(false);
           });
         },
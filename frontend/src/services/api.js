@@ -314,6 +314,7 @@ export const apiService = {
           onExecutionStart,
           onStepStart,
           onStepComplete,
+          onToken,
           onComplete,
           onError
         } = callbacks;
@@ -387,6 +388,10 @@ export const apiService = {
                     console.log(`[sendMessageStream-XHR] [${eventTime}ms] 触发 onStepComplete`);
                     onStepComplete && onStepComplete(data);
                     break;
+                  case 'token':
+                    // 最终答案的增量片段，完整答案以 complete 事件为准
+                    onToken && onToken(data);
+                    break;
                   case 'complete':
                     console.log(`[sendMessageStream-XHR] [${eventTime}ms] 触发 onComplete`);
                     onComplete && onComplete(data);
@@ -454,6 +459,7 @@ export const apiService = {
           onExecutionStart,
           onStepStart,
           onStepComplete,
+          onToken,
           onComplete,
           onError
         } = callbacks;
@@ -513,6 +519,11 @@ export const apiService = {
                 onStepComplete && onStepComplete(data);
                 break;
 
+              case 'token':
+                // 最终答案的增量片段，完整答案以 complete 事件为准
+                onToken && onToken(data);
+                break;
+
               case 'complete':
                 console.log(`[WebSocket] [${messageTime}ms] 触发 onComplete`);
                 onComplete && onComplete(data);